@@ -0,0 +1,91 @@
+"""Ajustes de SQLite para producción con varios workers de gunicorn.
+
+Con la configuración por omisión (journal "delete", sin busy_timeout) cada
+escritura bloquea a los lectores y una segunda escritura concurrente falla de
+inmediato con "database is locked". Aquí se activa WAL (lectores y un escritor
+en paralelo), se espera el candado en lugar de fallar y se reintenta la
+transacción completa cuando aun así hay contención.
+"""
+import functools
+import logging
+import random
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+
+log = logging.getLogger(__name__)
+
+BUSY_TIMEOUT_MS = 5000
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    # En WAL, NORMAL es seguro ante caídas de la app; solo un apagón puede
+    # perder la última transacción.
+    "synchronous": "NORMAL",
+    "busy_timeout": BUSY_TIMEOUT_MS,
+    "cache_size": -32000,        # KiB (negativo), ~32 MB por conexión
+    "mmap_size": 268435456,      # 256 MB
+    "temp_store": "MEMORY",
+}
+
+
+def opciones_motor(url=None, pool_size=5, max_overflow=10):
+    """SQLALCHEMY_ENGINE_OPTIONS; connect_args solo aplica a SQLite."""
+    opciones = {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": 30,
+    }
+    if url is None or make_url(url).get_backend_name() == "sqlite":
+        opciones["connect_args"] = {
+            "timeout": BUSY_TIMEOUT_MS / 1000,
+            # El pool reparte conexiones entre hilos (peticiones y subidas)
+            "check_same_thread": False,
+        }
+    return opciones
+
+
+def configurar_pragmas(engine, pragmas=None):
+    """Aplica los PRAGMA en cada conexión nueva del motor (solo SQLite)."""
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = PRAGMAS if pragmas is None else pragmas
+
+    @event.listens_for(engine, "connect")
+    def _aplicar(dbapi_conn, registro):
+        cursor = dbapi_conn.cursor()
+        for nombre, valor in pragmas.items():
+            cursor.execute(f"PRAGMA {nombre}={valor}")
+        cursor.close()
+
+
+def es_bloqueo(error):
+    mensaje = str(getattr(error, "orig", error)).lower()
+    return "database is locked" in mensaje or "database is busy" in mensaje
+
+
+def con_reintentos(session, intentos=5, espera=0.05):
+    """Reintenta la función completa si SQLite devuelve "database is locked".
+
+    busy_timeout no cubre todo: en WAL, una transacción que empezó leyendo y
+    luego quiere escribir falla sin esperar si otro escritor ya hizo commit.
+    La función decorada debe hacer todo su trabajo (incluido el commit) para
+    poder repetirse tras el rollback.
+    """
+    def decorador(fn):
+        @functools.wraps(fn)
+        def envoltura(*args, **kwargs):
+            for intento in range(intentos):
+                try:
+                    return fn(*args, **kwargs)
+                except OperationalError as e:
+                    session.rollback()
+                    if not es_bloqueo(e) or intento == intentos - 1:
+                        raise
+                    pausa = espera * 2 ** intento * (1 + random.random())
+                    log.warning("Base de datos ocupada, reintento en %.2fs", pausa)
+                    time.sleep(pausa)
+        return envoltura
+    return decorador
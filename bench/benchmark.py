@@ -0,0 +1,255 @@
+"""Benchmark de las rutas principales con el test client de Flask.
+
+Para cada tamaño de datos genera (o reutiliza) una base sintética con
+generar_datos.py y mide en un proceso aparte p50/p99 de latencia y el pico
+de memoria (tracemalloc) del listado, el listado filtrado, el dashboard y la
+captura de gastos con y sin foto. Todo corre sin red: Cloudinary se sustituye
+por un backend falso.
+
+    python bench/benchmark.py --tamanos 10000,100000,1000000
+    python bench/benchmark.py --guardar-base
+
+Sin --guardar-base compara contra bench/baseline.json y termina con código 1
+si alguna ruta empeora más que el umbral. El repositorio no incluye ese
+archivo (los números dependen de la máquina): hasta correr --guardar-base en
+la máquina de referencia no hay comparación y solo se imprimen los
+resultados.
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(AQUI)
+BASE = os.path.join(AQUI, "baseline.json")
+
+
+# -------------------------
+# MEDICIÓN (proceso hijo)
+# -------------------------
+class SubidaFalsa:
+    """Sustituto de Cloudinary: no toca la red ni el disco."""
+
+    miniatura_local = False
+
+    def subir(self, ruta):
+        nombre = os.path.basename(ruta)
+        return f"https://bench.invalid/{nombre}", f"bench/{nombre}"
+
+    def miniatura(self, ruta, public_id):
+        return f"https://bench.invalid/{public_id}-min"
+
+
+def _sin_red(*args, **kwargs):
+    raise RuntimeError("El benchmark no debe llamar a Cloudinary")
+
+
+def _foto():
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (1600, 1200), (180, 160, 140)).save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _rutas(main, obra_ids, rng):
+    foto = _foto()
+    lectura = main.app.test_client()
+    escritura = main.app.test_client()
+
+    def obra():
+        return rng.choice(obra_ids)
+
+    def listado():
+        return lectura.get(f"/gastos?obra_id={obra()}")
+
+    def listado_filtrado():
+        desde = date(2025, 1, 1) + timedelta(days=rng.randrange(300))
+        hasta = desde + timedelta(days=30)
+        return lectura.get(f"/gastos?obra_id={obra()}&desde={desde}&hasta={hasta}")
+
+    def dashboard():
+        return lectura.get("/dashboard")
+
+    def crear_gasto():
+        return escritura.post("/gastos", data={
+            "obra_id": obra(), "concepto": "Cemento", "monto": "180.50", "fecha": "2025-06-01",
+        })
+
+    def crear_gasto_foto():
+        return escritura.post("/gastos", data={
+            "obra_id": obra(), "concepto": "Varilla", "monto": "2500", "fecha": "2025-06-01",
+            "ticket": (io.BytesIO(foto), "ticket.jpg"),
+        }, content_type="multipart/form-data")
+
+    return {
+        "listado": listado,
+        "listado_filtrado": listado_filtrado,
+        "dashboard": dashboard,
+        "crear_gasto": crear_gasto,
+        "crear_gasto_foto": crear_gasto_foto,
+    }
+
+
+def medir(ruta_db, iteraciones, calentamiento=5, con_cache=False):
+    os.environ["DATABASE_URL"] = f"sqlite:///{ruta_db}"
+    os.environ["SUBIDAS_BACKEND"] = "local"
+    os.environ["SUBIDAS_DIR"] = tempfile.mkdtemp(prefix="construar-bench-")
+    os.environ["PERFIL_MUESTREO"] = "0"
+    if not con_cache:
+        os.environ["CACHE_TTL"] = "0"
+    sys.path.insert(0, RAIZ)
+
+    import cloudinary.uploader
+    cloudinary.uploader.upload = _sin_red
+    import main
+
+    main.cola_subidas.backend = SubidaFalsa()
+    with main.app.app_context():
+        obra_ids = main.db.session.execute(main.db.select(main.Obra.id)).scalars().all()
+
+    rng = random.Random(7)
+    resultados = {}
+    for nombre, peticion in _rutas(main, obra_ids, rng).items():
+        for _ in range(calentamiento):
+            peticion()
+
+        gc.collect()
+        tiempos = []
+        for _ in range(iteraciones):
+            inicio = time.perf_counter()
+            respuesta = peticion()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+            if respuesta.status_code not in (200, 302):
+                raise RuntimeError(f"{nombre}: HTTP {respuesta.status_code}")
+
+        tracemalloc.start()
+        for _ in range(calentamiento):
+            peticion()
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        cuantiles = statistics.quantiles(tiempos, n=100, method="inclusive")
+        resultados[nombre] = {
+            "p50_ms": round(cuantiles[49], 3),
+            "p99_ms": round(cuantiles[98], 3),
+            "media_ms": round(statistics.fmean(tiempos), 3),
+            "mem_pico_kb": round(pico / 1024, 1),
+        }
+
+    main.cola_subidas.esperar()
+    return resultados
+
+
+# -------------------------
+# ORQUESTACIÓN
+# -------------------------
+def _base_de_datos(directorio, obras, gastos, semilla):
+    ruta = os.path.join(directorio, f"bench-{obras}-{gastos}-{semilla}.db")
+    if not os.path.exists(ruta):
+        print(f"Generando {gastos} gastos en {obras} obras...", file=sys.stderr)
+        subprocess.run(
+            [sys.executable, os.path.join(AQUI, "generar_datos.py"), ruta,
+             "--obras", str(obras), "--gastos", str(gastos), "--semilla", str(semilla)],
+            check=True, stdout=sys.stderr,
+        )
+    return ruta
+
+
+def _medir_en_proceso(ruta, args):
+    # Copia de trabajo: la captura de gastos modifica la base
+    copia = ruta + ".trabajo"
+    shutil.copyfile(ruta, copia)
+    try:
+        comando = [sys.executable, __file__, "--medir", copia, "--iteraciones", str(args.iteraciones)]
+        if args.con_cache:
+            comando.append("--con-cache")
+        salida = subprocess.run(comando, check=True, capture_output=True, text=True).stdout
+    finally:
+        for extra in ("", "-wal", "-shm"):
+            if os.path.exists(copia + extra):
+                os.remove(copia + extra)
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+def comparar(resultados, base, umbral, umbral_p99, min_ms):
+    regresiones = []
+    for tamano, rutas in resultados.items():
+        for ruta, actual in rutas.items():
+            anterior = base.get(tamano, {}).get(ruta)
+            if not anterior:
+                continue
+            for campo, limite in (("p50_ms", umbral), ("p99_ms", umbral_p99), ("mem_pico_kb", umbral)):
+                antes, ahora = anterior[campo], actual[campo]
+                piso = min_ms if campo.endswith("_ms") else 0
+                if ahora > antes * (1 + limite) and ahora - antes > piso:
+                    regresiones.append(f"{tamano} {ruta} {campo}: {antes} -> {ahora} (+{(ahora / antes - 1) * 100:.0f}%)")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tamanos", default="10000,100000", help="número de gastos, separados por coma")
+    parser.add_argument("--obras", type=int, default=300)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--iteraciones", type=int, default=200)
+    parser.add_argument("--datos", default=os.path.join(tempfile.gettempdir(), "construar-bench"),
+                        help="directorio donde se guardan (y reutilizan) las bases generadas")
+    parser.add_argument("--base", default=BASE, help="archivo de referencia")
+    parser.add_argument("--guardar-base", action="store_true", help="guarda los resultados como referencia")
+    parser.add_argument("--umbral", type=float, default=0.25, help="regresión máxima en p50 y memoria")
+    parser.add_argument("--umbral-p99", type=float, default=0.5)
+    parser.add_argument("--min-ms", type=float, default=0.5, help="ignora diferencias menores a esto")
+    parser.add_argument("--con-cache", action="store_true", help="mide con la caché de páginas activa")
+    parser.add_argument("--medir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        print(json.dumps(medir(args.medir, args.iteraciones, con_cache=args.con_cache)))
+        return
+
+    os.makedirs(args.datos, exist_ok=True)
+    resultados = {}
+    for tamano in [int(t) for t in args.tamanos.split(",")]:
+        ruta = _base_de_datos(args.datos, args.obras, tamano, args.semilla)
+        resultados[str(tamano)] = _medir_en_proceso(ruta, args)
+
+        print(f"\n{tamano} gastos / {args.obras} obras")
+        print(f"  {'ruta':<18}{'p50 ms':>10}{'p99 ms':>10}{'mem KB':>10}")
+        for nombre, r in resultados[str(tamano)].items():
+            print(f"  {nombre:<18}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['mem_pico_kb']:>10.0f}")
+
+    if args.guardar_base:
+        with open(args.base, "w") as f:
+            json.dump(resultados, f, indent=2, sort_keys=True)
+        print(f"\nReferencia guardada en {args.base}")
+        return
+
+    if not os.path.exists(args.base):
+        print(f"\nSin referencia en {args.base}; usa --guardar-base para crearla")
+        return
+
+    with open(args.base) as f:
+        base = json.load(f)
+    regresiones = comparar(resultados, base, args.umbral, args.umbral_p99, args.min_ms)
+    if regresiones:
+        print("\nRegresiones:")
+        for r in regresiones:
+            print(f"  {r}")
+        sys.exit(1)
+    print("\nSin regresiones contra la referencia")
+
+
+if __name__ == "__main__":
+    main()
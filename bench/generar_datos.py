@@ -0,0 +1,142 @@
+"""Genera una base de datos sintética con volúmenes de producción.
+
+Cientos de obras, millones de gastos repartidos en varios años y partidas de
+presupuesto por obra. Con la misma semilla el resultado es idéntico, para que
+los benchmarks sean comparables entre corridas.
+
+    python bench/generar_datos.py /tmp/bench.db --obras 300 --gastos 2000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LUGARES = ["Valle de Bravo", "Toluca", "Metepec", "Querétaro", "Cuernavaca", "Puebla", "Pachuca", "Tepoztlán"]
+TIPOS = ["Casa", "Bodega", "Local", "Fraccionamiento", "Remodelación", "Edificio", "Barda", "Nave"]
+# (concepto, monto típico)
+CONCEPTOS = [
+    ("Cemento", 180), ("Varilla", 2500), ("Block", 1200), ("Arena", 900), ("Grava", 950),
+    ("Mano de obra", 6000), ("Flete", 700), ("Gasolina", 600), ("Renta de revolvedora", 800),
+    ("Tubería PVC", 450), ("Cableado", 1600), ("Impermeabilizante", 2200), ("Azulejo", 3200),
+    ("Pintura", 1400),
+]
+# Fecha fija para que la misma semilla genere siempre los mismos datos
+FIN = date(2025, 12, 31)
+PARTIDAS = [
+    ("PRE", "Preliminares", "m2"), ("CIM", "Cimentación", "m3"), ("EST", "Estructura", "m3"),
+    ("ALB", "Albañilería", "m2"), ("INS", "Instalación eléctrica", "sal"), ("HID", "Instalación hidráulica", "sal"),
+    ("ACA", "Acabados", "m2"), ("HER", "Herrería", "pza"), ("CAR", "Carpintería", "pza"), ("LIM", "Limpieza", "lote"),
+]
+
+
+def preparar_esquema(ruta):
+    """Crea las tablas importando la app contra la base destino."""
+    os.environ["DATABASE_URL"] = f"sqlite:///{ruta}"
+    os.environ.setdefault("SUBIDAS_BACKEND", "local")
+    os.environ.setdefault("SUBIDAS_DIR", tempfile.mkdtemp(prefix="construar-bench-"))
+    sys.path.insert(0, RAIZ)
+    import main
+    return main
+
+
+def _obras(rng, n):
+    inicio = datetime(2021, 1, 1)
+    for i in range(1, n + 1):
+        creado = inicio + timedelta(days=rng.randrange(365))
+        yield (i, f"{rng.choice(TIPOS)} {rng.choice(LUGARES)} {i:04d}", creado.isoformat(" "))
+
+
+def _partidas(rng, obras, por_obra):
+    for obra_id in range(1, obras + 1):
+        for j in range(por_obra):
+            codigo, descripcion, unidad = PARTIDAS[j % len(PARTIDAS)]
+            yield (obra_id, f"{codigo}-{j + 1:02d}", descripcion, unidad,
+                   round(rng.uniform(1, 400), 2), round(rng.lognormvariate(6.5, 1.0), 2))
+
+
+def _gastos(rng, obras, n, desde, dias):
+    # Pocas obras grandes concentran la mayoría de los gastos
+    pesos = [rng.paretovariate(1.2) for _ in range(obras)]
+    obra_ids = rng.choices(range(1, obras + 1), weights=pesos, k=n)
+    for i, obra_id in enumerate(obra_ids, start=1):
+        concepto, media = rng.choice(CONCEPTOS)
+        fecha = desde + timedelta(days=rng.randrange(dias))
+        creado = datetime.combine(fecha, datetime.min.time()) + timedelta(minutes=rng.randrange(600, 1200))
+        con_foto = rng.random() < 0.6
+        yield (
+            obra_id,
+            concepto,
+            round(rng.lognormvariate(0, 0.7) * media, 2),
+            fecha.isoformat(),
+            f"https://res.cloudinary.com/demo/image/upload/construar/gastos/{i}.webp" if con_foto else None,
+            f"construar/gastos/{i}" if con_foto else None,
+            "subida" if con_foto else None,
+            creado.isoformat(" "),
+            creado.isoformat(" "),
+        )
+
+
+def generar(ruta, obras=300, gastos=1_000_000, partidas=40, anios=3, semilla=42, lote=50_000):
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    main = preparar_esquema(ruta)
+    with main.app.app_context():
+        main.db.engine.dispose()
+    rng = random.Random(semilla)
+
+    conn = sqlite3.connect(ruta)
+    # Solo durante la carga: sin fsync
+    conn.execute("PRAGMA synchronous=OFF")
+
+    conn.executemany("INSERT INTO obra (id, nombre, creado) VALUES (?, ?, ?)", _obras(rng, obras))
+    conn.executemany(
+        "INSERT INTO partida_presupuesto (obra_id, partida, descripcion, unidad, cantidad, precio_unitario) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        _partidas(rng, obras, partidas),
+    )
+
+    desde = FIN - timedelta(days=365 * anios)
+    filas = _gastos(rng, obras, gastos, desde, 365 * anios)
+    sql = ("INSERT INTO gasto (obra_id, concepto, monto, fecha, foto_url, foto_public_id, foto_estado, creado, actualizado) "
+           "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+    insertados = 0
+    while True:
+        bloque = [f for _, f in zip(range(lote), filas)]
+        if not bloque:
+            break
+        conn.executemany(sql, bloque)
+        conn.commit()
+        insertados += len(bloque)
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+    with main.app.app_context():
+        main.reconstruir_resumen()
+        main.db.engine.dispose()
+    return insertados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("ruta", help="archivo SQLite a crear (se reemplaza)")
+    parser.add_argument("--obras", type=int, default=300)
+    parser.add_argument("--gastos", type=int, default=1_000_000)
+    parser.add_argument("--partidas", type=int, default=40, help="partidas de presupuesto por obra")
+    parser.add_argument("--anios", type=int, default=3)
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    n = generar(os.path.abspath(args.ruta), args.obras, args.gastos, args.partidas, args.anios, args.semilla)
+    print(f"{args.obras} obras, {n} gastos en {time.perf_counter() - inicio:.1f}s -> {args.ruta}")
+
+
+if __name__ == "__main__":
+    main()
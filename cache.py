@@ -0,0 +1,129 @@
+"""Caché de respuestas para las vistas de solo lectura.
+
+La clave de cada página es la vista + sus parámetros (obra_id, fecha, ...) +
+la "generación" de cada tabla de la que depende. Al confirmarse un cambio en
+una tabla su generación sube, y las páginas guardadas con la anterior dejan
+de encontrarse (se van por LRU/TTL). Las respuestas llevan ETag y
+Last-Modified para que el navegador revalide con un 304.
+
+Backends:
+- CacheLRU: en memoria del proceso. Con varios workers de gunicorn cada uno
+  tiene su propia copia y solo se entera de los cambios hechos por él mismo;
+  el TTL acota cuánto puede tardar en ver los de los demás.
+- CacheRedis: compartido entre workers (requiere el paquete `redis`).
+"""
+import functools
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import make_response, request, session
+
+
+class CacheLRU:
+    def __init__(self, max_entradas=256, ttl=30):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        # Las generaciones no caducan ni se desalojan
+        self._generaciones = {}
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            vence, valor = entrada
+            if vence < time.monotonic():
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            return valor
+
+    def set(self, clave, valor):
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def generaciones(self, tablas):
+        with self._lock:
+            return [self._generaciones.get(t, 0) for t in tablas]
+
+    def incrementar(self, tablas):
+        with self._lock:
+            for t in tablas:
+                self._generaciones[t] = self._generaciones.get(t, 0) + 1
+
+
+class CacheRedis:
+    def __init__(self, url, ttl=300, prefijo="construar:"):
+        import redis
+
+        self.cliente = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefijo = prefijo
+
+    def get(self, clave):
+        valor = self.cliente.get(self.prefijo + clave)
+        return pickle.loads(valor) if valor is not None else None
+
+    def set(self, clave, valor):
+        self.cliente.setex(self.prefijo + clave, self.ttl, pickle.dumps(valor))
+
+    def generaciones(self, tablas):
+        valores = self.cliente.mget([f"{self.prefijo}gen:{t}" for t in tablas])
+        return [int(v or 0) for v in valores]
+
+    def incrementar(self, tablas):
+        with self.cliente.pipeline() as p:
+            for t in tablas:
+                p.incr(f"{self.prefijo}gen:{t}")
+            p.execute()
+
+
+class CacheVistas:
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    def invalidar(self, tablas):
+        if self.backend and tablas:
+            self.backend.incrementar(sorted(tablas))
+
+    def vista(self, *tablas):
+        """Guarda la respuesta GET de la vista; depende de `tablas`."""
+        def decorador(fn):
+            @functools.wraps(fn)
+            def envoltura(*args, **kwargs):
+                # Las páginas con mensajes flash son de un solo uso
+                if self.backend is None or request.method != "GET" or "_flashes" in session:
+                    return fn(*args, **kwargs)
+
+                generaciones = self.backend.generaciones(tablas)
+                parametros = sorted(request.args.items(multi=True))
+                clave = f"vista:{request.endpoint}:{generaciones}:{parametros}"
+
+                entrada = self.backend.get(clave)
+                if entrada is None:
+                    respuesta = make_response(fn(*args, **kwargs))
+                    if respuesta.status_code != 200 or respuesta.is_streamed:
+                        return respuesta
+                    cuerpo = respuesta.get_data()
+                    entrada = (cuerpo, respuesta.mimetype, hashlib.sha1(cuerpo).hexdigest(), time.time())
+                    self.backend.set(clave, entrada)
+
+                cuerpo, mimetype, etag, modificado = entrada
+                respuesta = make_response(cuerpo)
+                respuesta.mimetype = mimetype
+                respuesta.set_etag(etag)
+                respuesta.last_modified = modificado
+                # El navegador guarda la página pero pregunta antes de usarla
+                respuesta.cache_control.private = True
+                respuesta.cache_control.no_cache = True
+                return respuesta.make_conditional(request)
+            return envoltura
+        return decorador
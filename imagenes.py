@@ -0,0 +1,53 @@
+"""Recompresión de fotos de tickets antes de subirlas.
+
+Las fotos de celular llegan a resolución completa y con EXIF (incluida la
+ubicación GPS). Aquí se corrige la orientación, se descarta el EXIF, se reduce
+al lado máximo configurado y se recodifica; además se genera una miniatura
+para el listado de gastos.
+"""
+import os
+import uuid
+
+from PIL import Image, ImageOps
+
+EXTENSIONES = {"WEBP": ".webp", "JPEG": ".jpg"}
+
+
+def _a_rgb(img):
+    if img.mode in ("RGB", "L"):
+        return img
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        fondo = Image.new("RGB", img.size, (255, 255, 255))
+        fondo.paste(img, mask=img.getchannel("A"))
+        return fondo
+    return img.convert("RGB")
+
+
+def _guardar(img, directorio, formato, calidad):
+    ruta = os.path.join(directorio, f"proc-{uuid.uuid4().hex}{EXTENSIONES[formato]}")
+    # Sin exif=...: Pillow no copia los metadatos al recodificar.
+    img.save(ruta, formato, quality=calidad, optimize=True)
+    return ruta
+
+
+def procesar_imagen(origen, max_lado=1600, calidad=80, formato="WEBP", lado_miniatura=280):
+    """Regresa (ruta_imagen, ruta_miniatura), escritas junto al original.
+
+    Con lado_miniatura=None no se genera la miniatura (ruta_miniatura None).
+    """
+    directorio = os.path.dirname(origen)
+    with Image.open(origen) as img:
+        # En JPEG decodifica directamente a una escala cercana: mucho menos
+        # memoria y CPU con fotos de 12+ MP.
+        img.draft("RGB", (max_lado, max_lado))
+        img = _a_rgb(ImageOps.exif_transpose(img))
+
+    img.thumbnail((max_lado, max_lado), Image.LANCZOS)
+    ruta = _guardar(img, directorio, formato, calidad)
+
+    if lado_miniatura is None:
+        return ruta, None
+    img.thumbnail((lado_miniatura, lado_miniatura), Image.LANCZOS)
+    miniatura = _guardar(img, directorio, formato, calidad)
+    return ruta, miniatura
@@ -0,0 +1,147 @@
+"""Importación y exportación masiva de gastos (CSV / XLSX).
+
+La lectura es por lotes para no cargar el archivo completo en objetos; la
+escritura del CSV se genera por bloques para poder enviarla como respuesta
+en streaming.
+"""
+import csv
+import io
+import math
+import os
+import zipfile
+from datetime import date, datetime
+
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+COLUMNAS_EXPORTACION = ["id", "fecha", "obra_id", "obra", "concepto", "monto", "foto_url"]
+
+# Excel ejecuta como fórmula el texto que empieza con estos caracteres
+INICIO_FORMULA = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _normalizar(encabezado):
+    return [str(c or "").strip().lower() for c in encabezado]
+
+
+def _filas_csv(archivo):
+    texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", newline="")
+    lector = csv.reader(texto)
+    encabezado = _normalizar(next(lector, []))
+    for valores in lector:
+        yield dict(zip(encabezado, valores))
+
+
+def _filas_xlsx(archivo):
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        filas = libro.active.iter_rows(values_only=True)
+        encabezado = _normalizar(next(filas, []))
+        for valores in filas:
+            yield dict(zip(encabezado, valores))
+    finally:
+        libro.close()
+
+
+def leer_lotes(archivo, nombre, tamano=2000):
+    """Genera listas de (numero_de_fila, dict) de a lo más `tamano` filas."""
+    _, ext = os.path.splitext(nombre.lower())
+    if ext == ".xlsx":
+        filas = _filas_xlsx(archivo)
+    elif ext == ".csv":
+        filas = _filas_csv(archivo)
+    else:
+        raise ValueError("Formato no soportado, usa CSV o XLSX")
+
+    lote = []
+    # La fila 1 es el encabezado
+    numero = 1
+    try:
+        for numero, fila in enumerate(filas, start=2):
+            if not any(v not in (None, "") for v in fila.values()):
+                continue
+            lote.append((numero, fila))
+            if len(lote) >= tamano:
+                yield lote
+                lote = []
+    except UnicodeDecodeError:
+        raise ValueError(f"el CSV no está en UTF-8 (después de la fila {numero})")
+    except csv.Error as e:
+        raise ValueError(f"CSV inválido después de la fila {numero}: {e}")
+    except (zipfile.BadZipFile, InvalidFileException, KeyError, OSError):
+        raise ValueError("el archivo XLSX está dañado o no es un libro de Excel")
+    if lote:
+        yield lote
+
+
+def _fecha(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    try:
+        return datetime.strptime(str(valor).strip(), "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(f"fecha inválida '{valor}' (usa AAAA-MM-DD)")
+
+
+def validar_fila(fila, obras_por_id, obras_por_nombre):
+    """Convierte una fila del archivo en valores para insertar en gasto.
+
+    La obra se indica con `obra_id` o con `obra` (nombre exacto).
+    """
+    obra_id = fila.get("obra_id")
+    if obra_id not in (None, ""):
+        try:
+            obra_id = int(float(obra_id))
+        except (ValueError, TypeError, OverflowError):
+            raise ValueError(f"obra_id inválido '{obra_id}'")
+        if obra_id not in obras_por_id:
+            raise ValueError(f"la obra {obra_id} no existe")
+    else:
+        nombre = str(fila.get("obra") or "").strip()
+        if nombre not in obras_por_nombre:
+            raise ValueError(f"la obra '{nombre}' no existe")
+        obra_id = obras_por_nombre[nombre]
+
+    concepto = str(fila.get("concepto") or "").strip()
+    if not concepto:
+        raise ValueError("falta el concepto")
+
+    try:
+        monto = float(str(fila.get("monto")).replace(",", "").replace("$", ""))
+    except ValueError:
+        raise ValueError(f"monto inválido '{fila.get('monto')}'")
+    # SQLite guarda NaN como NULL y rompería el lote completo
+    if not math.isfinite(monto):
+        raise ValueError(f"monto inválido '{fila.get('monto')}'")
+
+    return {
+        "obra_id": obra_id,
+        "fecha": _fecha(fila.get("fecha")),
+        "concepto": concepto[:200],
+        "monto": monto,
+    }
+
+
+def _celda(valor):
+    # Solo texto: los números (monto, ids) se exportan tal cual
+    if isinstance(valor, str) and valor.startswith(INICIO_FORMULA):
+        return "'" + valor
+    return valor
+
+
+def csv_por_bloques(filas, encabezado=COLUMNAS_EXPORTACION, filas_por_bloque=1000):
+    """Genera el CSV en bloques de texto a partir de un iterable de filas."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    # BOM para que Excel abra bien los acentos
+    buffer.write("\ufeff")
+    escritor.writerow(encabezado)
+    for n, fila in enumerate(filas, start=1):
+        escritor.writerow([_celda(v) for v in fila])
+        if n % filas_por_bloque == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
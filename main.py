@@ -1,9 +1,20 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, send_from_directory, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy import and_, delete, event, func, insert, inspect, or_, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from datetime import datetime, timedelta
+import json
 import os
+import click
 import cloudinary
-import cloudinary.uploader
+
+from cache import CacheLRU, CacheRedis, CacheVistas
+from basedatos import con_reintentos, configurar_pragmas, opciones_motor
+from imagenes import procesar_imagen
+from metricas import Metricas
+from intercambio import COLUMNAS_EXPORTACION, csv_por_bloques, leer_lotes, validar_fila
+from subidas import ColaSubidas, SubidaCloudinary, SubidaLocal
 
 # -------------------------
 # APP
@@ -18,14 +29,86 @@ BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 INSTANCE_DIR = os.path.join(BASE_DIR, "instance")
 os.makedirs(INSTANCE_DIR, exist_ok=True)
 
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(INSTANCE_DIR, "construar_v2.db")
+app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv(
+    "DATABASE_URL", "sqlite:///" + os.path.join(INSTANCE_DIR, "construar_v2.db")
+)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# WAL, busy_timeout y pool: ver basedatos.py
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = opciones_motor(app.config["SQLALCHEMY_DATABASE_URI"])
+
+# Limite de subida: las fotos grandes se aceptan y se reducen antes de guardarlas
+app.config["MAX_SUBIDA_MB"] = int(os.getenv("MAX_SUBIDA_MB", "20"))
+app.config["MAX_CONTENT_LENGTH"] = app.config["MAX_SUBIDA_MB"] * 1024 * 1024
+
+# Gastos por página en el listado (paginación por cursor)
+app.config["GASTOS_POR_PAGINA"] = int(os.getenv("GASTOS_POR_PAGINA", "50"))
 
-# Limite de subida: 3 MB
-app.config["MAX_CONTENT_LENGTH"] = 3 * 1024 * 1024
+# Filas por transacción al importar gastos
+app.config["IMPORTAR_LOTE"] = int(os.getenv("IMPORTAR_LOTE", "2000"))
+
+# Sincronización desde el celular: cambios por respuesta y margen (segundos)
+# para no entregar filas cuya transacción podría seguir abierta
+app.config["SYNC_LIMITE"] = int(os.getenv("SYNC_LIMITE", "500"))
+app.config["SYNC_MARGEN"] = int(os.getenv("SYNC_MARGEN", "5"))
+
+# Caché de páginas: en memoria por omisión; CACHE_URL=redis://... para
+# compartirla entre workers de gunicorn; CACHE_TTL (segundos) aplica a
+# ambos y CACHE_TTL=0 la desactiva aunque haya CACHE_URL
+app.config["CACHE_URL"] = os.getenv("CACHE_URL")
+app.config["CACHE_TTL"] = int(os.getenv("CACHE_TTL", "30"))
+app.config["CACHE_MAX"] = int(os.getenv("CACHE_MAX", "256"))
+
+# Perfilado de peticiones lentas (ver metricas.py): fracción a perfilar y umbral
+app.config["PERFIL_MUESTREO"] = float(os.getenv("PERFIL_MUESTREO", "0"))
+app.config["PERFIL_LENTO_MS"] = int(os.getenv("PERFIL_LENTO_MS", "500"))
 
 db = SQLAlchemy(app)
 
+metricas = Metricas()
+
+with app.app_context():
+    configurar_pragmas(db.engine)
+    metricas.init_app(app, db.engine)
+
+# -------------------------
+# CACHÉ DE PÁGINAS
+# -------------------------
+def crear_cache():
+    if app.config["CACHE_TTL"] <= 0:
+        return None
+    if app.config["CACHE_URL"]:
+        return CacheRedis(app.config["CACHE_URL"], ttl=app.config["CACHE_TTL"])
+    return CacheLRU(app.config["CACHE_MAX"], app.config["CACHE_TTL"])
+
+cache = CacheVistas(crear_cache())
+
+def _tablas_cambiadas(session):
+    return session.info.setdefault("tablas_cambiadas", set())
+
+@event.listens_for(db.session, "after_flush")
+def registrar_cambios(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        _tablas_cambiadas(session).add(obj.__table__.name)
+
+@event.listens_for(db.session, "do_orm_execute")
+def registrar_dml(estado):
+    # INSERT/UPDATE/DELETE masivos (importación, resumen) no pasan por flush
+    if (estado.is_insert or estado.is_update or estado.is_delete) and estado.bind_mapper:
+        _tablas_cambiadas(estado.session).add(estado.bind_mapper.local_table.name)
+
+@event.listens_for(db.session, "after_commit")
+def invalidar_cache(session):
+    cache.invalidar(session.info.pop("tablas_cambiadas", None))
+
+@event.listens_for(db.session, "after_rollback")
+def descartar_cambios(session):
+    session.info.pop("tablas_cambiadas", None)
+
+@con_reintentos(db.session)
+def guardar(*objetos):
+    db.session.add_all(objetos)
+    db.session.commit()
+
 # -------------------------
 # CLOUDINARY
 # -------------------------
@@ -35,6 +118,22 @@ cloudinary.config(
     api_secret=os.getenv("CLOUDINARY_API_SECRET")
 )
 
+# -------------------------
+# SUBIDAS EN SEGUNDO PLANO
+# -------------------------
+# "cloudinary" en producción, "local" para pruebas sin red
+app.config["SUBIDAS_BACKEND"] = os.getenv("SUBIDAS_BACKEND", "cloudinary")
+app.config["SUBIDAS_DIR"] = os.getenv("SUBIDAS_DIR", os.path.join(INSTANCE_DIR, "subidas"))
+app.config["SUBIDAS_WORKERS"] = int(os.getenv("SUBIDAS_WORKERS", "2"))
+app.config["SUBIDAS_REINTENTOS"] = int(os.getenv("SUBIDAS_REINTENTOS", "4"))
+
+# Recompresión de la foto antes de subirla
+app.config["IMAGEN_MAX_LADO"] = int(os.getenv("IMAGEN_MAX_LADO", "1600"))
+app.config["IMAGEN_CALIDAD"] = int(os.getenv("IMAGEN_CALIDAD", "80"))
+app.config["IMAGEN_FORMATO"] = os.getenv("IMAGEN_FORMATO", "WEBP")  # WEBP o JPEG
+# La miniatura se muestra a 140px: 280px cubre pantallas de alta densidad
+app.config["IMAGEN_MINIATURA"] = int(os.getenv("IMAGEN_MINIATURA", "280"))
+
 # -------------------------
 # MODELOS
 # -------------------------
@@ -45,21 +144,342 @@ class Obra(db.Model):
 
 class Gasto(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    obra_id = db.Column(db.Integer, db.ForeignKey("obra.id"), nullable=False)
+    # active_history: el resumen necesita el valor anterior aunque el
+    # atributo esté expirado (p. ej. después de un commit)
+    obra_id = db.mapped_column(db.Integer, db.ForeignKey("obra.id"), nullable=False, active_history=True)
     concepto = db.Column(db.String(200), nullable=False)
-    monto = db.Column(db.Float, nullable=False)
-    fecha = db.Column(db.Date, nullable=False)
+    monto = db.mapped_column(db.Float, nullable=False, active_history=True)
+    fecha = db.mapped_column(db.Date, nullable=False, active_history=True)
     foto_url = db.Column(db.String(500))
     foto_public_id = db.Column(db.String(200))
+    foto_miniatura_url = db.Column(db.String(500))
+    # None (sin foto) / "pendiente" / "subida" / "error"
+    foto_estado = db.Column(db.String(20))
     creado = db.Column(db.DateTime, default=datetime.utcnow)
+    # Clave generada por el celular: reenviar el mismo gasto no lo duplica
+    clave = db.Column(db.String(64), unique=True, index=True)
+    actualizado = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     obra = db.relationship("Obra", backref=db.backref("gastos", lazy=True))
 
+    # El listado siempre filtra por obra y ordena por (fecha, id):
+    # con este índice la consulta es un rango sobre el índice.
+    __table_args__ = (
+        db.Index("ix_gasto_obra_fecha", "obra_id", "fecha", "id"),
+        db.Index("ix_gasto_actualizado", "actualizado", "id"),
+    )
+
+class PartidaPresupuesto(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    obra_id = db.mapped_column(db.Integer, db.ForeignKey("obra.id"), nullable=False, index=True,
+                               active_history=True)
+    partida = db.Column(db.String(50), nullable=False)
+    descripcion = db.Column(db.String(250), nullable=False)
+    unidad = db.Column(db.String(30))
+    cantidad = db.mapped_column(db.Float, active_history=True)
+    precio_unitario = db.mapped_column(db.Float, active_history=True)
+    creado = db.Column(db.DateTime, default=datetime.utcnow)
+
+    obra = db.relationship("Obra", backref=db.backref("partidas", lazy=True))
+
+class ResumenObra(db.Model):
+    """Totales por obra, mantenidos en la misma transacción que cada cambio."""
+    obra_id = db.Column(db.Integer, db.ForeignKey("obra.id"), primary_key=True)
+    total_presupuesto = db.Column(db.Float, nullable=False, default=0)
+    total_gastado = db.Column(db.Float, nullable=False, default=0)
+    num_gastos = db.Column(db.Integer, nullable=False, default=0)
+    ultima_fecha = db.Column(db.Date)
+
 # -------------------------
 # CREAR TABLAS
 # -------------------------
-with app.app_context():
+def asegurar_esquema():
+    """create_all() no toca tablas existentes: agrega columnas e índices nuevos."""
     db.create_all()
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for tabla in db.metadata.sorted_tables:
+            existentes = {c["name"] for c in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name not in existentes:
+                    tipo = columna.type.compile(dialect=db.engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {tabla.name} ADD COLUMN "{columna.name}" {tipo}'))
+            for indice in tabla.indexes:
+                indice.create(conn, checkfirst=True)
+
+# -------------------------
+# RESUMEN POR OBRA
+# -------------------------
+def importe(cantidad, precio_unitario):
+    return (cantidad or 0) * (precio_unitario or 0)
+
+def valor_anterior(obj, campo):
+    # Requiere active_history en la columna; si no, un atributo expirado no
+    # tiene valor anterior y el delta se anula.
+    historia = inspect(obj).attrs[campo].history
+    return historia.deleted[0] if historia.deleted else getattr(obj, campo)
+
+def crear_fila_resumen(conn, obra_id):
+    """INSERT de la fila de la obra si aún no existe (ON CONFLICT DO NOTHING)."""
+    if conn.dialect.name in ("sqlite", "postgresql"):
+        dialecto = sqlite if conn.dialect.name == "sqlite" else postgresql
+        conn.execute(dialecto.insert(ResumenObra).values(obra_id=obra_id).on_conflict_do_nothing())
+    elif conn.execute(select(ResumenObra.obra_id).where(ResumenObra.obra_id == obra_id)).first() is None:
+        conn.execute(insert(ResumenObra).values(obra_id=obra_id))
+
+def ajustar_resumen(conn, deltas):
+    """Aplica {obra_id: {"presupuesto", "gastado", "gastos"}} con UPDATE atómicos.
+
+    ultima_fecha se vuelve a leer con MAX(fecha): con ix_gasto_obra_fecha es
+    una sola búsqueda en el índice.
+    """
+    for obra_id, d in deltas.items():
+        crear_fila_resumen(conn, obra_id)
+        valores = {
+            "total_presupuesto": ResumenObra.total_presupuesto + d.get("presupuesto", 0),
+            "total_gastado": ResumenObra.total_gastado + d.get("gastado", 0),
+            "num_gastos": ResumenObra.num_gastos + d.get("gastos", 0),
+        }
+        if "gastos" in d:
+            valores["ultima_fecha"] = (
+                select(func.max(Gasto.fecha)).where(Gasto.obra_id == obra_id).scalar_subquery()
+            )
+        conn.execute(update(ResumenObra).where(ResumenObra.obra_id == obra_id).values(**valores))
+
+def _sumar(deltas, obra_id, campo, valor):
+    d = deltas.setdefault(int(obra_id), {})
+    d[campo] = d.get(campo, 0) + valor
+    if campo == "gastado":
+        d.setdefault("gastos", 0)
+
+@event.listens_for(db.session, "after_flush")
+def actualizar_resumen(session, flush_context):
+    deltas = {}
+    nuevas, borradas = [], []
+
+    for obj in session.new:
+        if isinstance(obj, Obra):
+            nuevas.append(obj.id)
+        elif isinstance(obj, Gasto):
+            _sumar(deltas, obj.obra_id, "gastado", obj.monto or 0)
+            _sumar(deltas, obj.obra_id, "gastos", 1)
+        elif isinstance(obj, PartidaPresupuesto):
+            _sumar(deltas, obj.obra_id, "presupuesto", importe(obj.cantidad, obj.precio_unitario))
+
+    for obj in session.deleted:
+        if isinstance(obj, Obra):
+            borradas.append(obj.id)
+        elif isinstance(obj, Gasto):
+            _sumar(deltas, obj.obra_id, "gastado", -(obj.monto or 0))
+            _sumar(deltas, obj.obra_id, "gastos", -1)
+        elif isinstance(obj, PartidaPresupuesto):
+            _sumar(deltas, obj.obra_id, "presupuesto", -importe(obj.cantidad, obj.precio_unitario))
+
+    for obj in session.dirty:
+        if isinstance(obj, Gasto) and session.is_modified(obj):
+            if not any(inspect(obj).attrs[c].history.has_changes() for c in ("obra_id", "monto", "fecha")):
+                continue
+            _sumar(deltas, valor_anterior(obj, "obra_id"), "gastado", -(valor_anterior(obj, "monto") or 0))
+            _sumar(deltas, valor_anterior(obj, "obra_id"), "gastos", -1)
+            _sumar(deltas, obj.obra_id, "gastado", obj.monto or 0)
+            _sumar(deltas, obj.obra_id, "gastos", 1)
+        elif isinstance(obj, PartidaPresupuesto) and session.is_modified(obj):
+            anterior = importe(valor_anterior(obj, "cantidad"), valor_anterior(obj, "precio_unitario"))
+            _sumar(deltas, valor_anterior(obj, "obra_id"), "presupuesto", -anterior)
+            _sumar(deltas, obj.obra_id, "presupuesto", importe(obj.cantidad, obj.precio_unitario))
+
+    if not (deltas or nuevas or borradas):
+        return
+
+    conn = session.connection()
+    for obra_id in nuevas:
+        crear_fila_resumen(conn, obra_id)
+    ajustar_resumen(conn, deltas)
+    if borradas:
+        conn.execute(delete(ResumenObra).where(ResumenObra.obra_id.in_(borradas)))
+
+def calcular_resumen():
+    """Totales reales por obra, calculados desde cero con GROUP BY."""
+    gastos = {
+        r.obra_id: r
+        for r in db.session.execute(
+            select(
+                Gasto.obra_id,
+                func.coalesce(func.sum(Gasto.monto), 0).label("total"),
+                func.count(Gasto.id).label("num"),
+                func.max(Gasto.fecha).label("ultima"),
+            ).group_by(Gasto.obra_id)
+        )
+    }
+    presupuesto = dict(
+        db.session.execute(
+            select(
+                PartidaPresupuesto.obra_id,
+                func.coalesce(func.sum(
+                    func.coalesce(PartidaPresupuesto.cantidad, 0) * func.coalesce(PartidaPresupuesto.precio_unitario, 0)
+                ), 0),
+            ).group_by(PartidaPresupuesto.obra_id)
+        ).all()
+    )
+    resumen = {}
+    for obra_id in db.session.execute(select(Obra.id)).scalars():
+        g = gastos.get(obra_id)
+        resumen[obra_id] = {
+            "obra_id": obra_id,
+            "total_presupuesto": presupuesto.get(obra_id, 0),
+            "total_gastado": g.total if g else 0,
+            "num_gastos": g.num if g else 0,
+            "ultima_fecha": g.ultima if g else None,
+        }
+    return resumen
+
+def reconstruir_resumen():
+    resumen = calcular_resumen()
+    db.session.execute(delete(ResumenObra))
+    if resumen:
+        db.session.execute(insert(ResumenObra), list(resumen.values()))
+    db.session.commit()
+    return len(resumen)
+
+def verificar_resumen(tolerancia=0.01):
+    """Regresa las diferencias entre el resumen guardado y el real."""
+    esperado = calcular_resumen()
+    guardado = {r.obra_id: r for r in db.session.execute(select(ResumenObra)).scalars()}
+    diferencias = []
+    for obra_id in sorted(esperado.keys() | guardado.keys()):
+        real = esperado.get(obra_id)
+        fila = guardado.get(obra_id)
+        if real is None or fila is None:
+            diferencias.append((obra_id, "fila", fila is not None, real is not None))
+            continue
+        for campo in ("total_presupuesto", "total_gastado", "num_gastos", "ultima_fecha"):
+            actual, correcto = getattr(fila, campo), real[campo]
+            if isinstance(correcto, float):
+                iguales = abs((actual or 0) - correcto) <= tolerancia
+            else:
+                iguales = actual == correcto
+            if not iguales:
+                diferencias.append((obra_id, campo, actual, correcto))
+    return diferencias
+
+@app.cli.command("resumen")
+@click.option("--verificar", is_flag=True, help="Solo compara, no modifica.")
+def resumen_cmd(verificar):
+    """Reconstruye (o verifica) el resumen por obra."""
+    if verificar:
+        diferencias = verificar_resumen()
+        for obra_id, campo, actual, correcto in diferencias:
+            click.echo(f"obra {obra_id}: {campo} guardado={actual} real={correcto}")
+        click.echo("Resumen correcto" if not diferencias else f"{len(diferencias)} diferencias")
+        raise SystemExit(1 if diferencias else 0)
+    click.echo(f"Resumen reconstruido para {reconstruir_resumen()} obras")
+
+with app.app_context():
+    asegurar_esquema()
+    # Gastos anteriores a la sincronización no tienen fecha de cambio
+    db.session.execute(
+        update(Gasto).where(Gasto.actualizado.is_(None))
+        .values(actualizado=func.coalesce(Gasto.creado, func.current_timestamp()))
+    )
+    db.session.commit()
+    # Bases existentes: el resumen se llena una vez a partir de los datos
+    if not db.session.query(ResumenObra.obra_id).first() and db.session.query(Obra.id).first():
+        reconstruir_resumen()
+
+# -------------------------
+# COLA DE SUBIDAS
+# -------------------------
+@con_reintentos(db.session)
+def actualizar_gasto(gasto_id, **campos):
+    gasto = db.session.get(Gasto, gasto_id)
+    if gasto:
+        for campo, valor in campos.items():
+            setattr(gasto, campo, valor)
+        db.session.commit()
+
+def foto_subida(gasto_id, url, public_id, miniatura_url):
+    with app.app_context():
+        actualizar_gasto(
+            gasto_id,
+            foto_url=url,
+            foto_public_id=public_id,
+            foto_miniatura_url=miniatura_url,
+            foto_estado="subida",
+        )
+
+def foto_fallida(gasto_id, error):
+    app.logger.error("No se pudo subir la foto del gasto %s: %s", gasto_id, error)
+    with app.app_context():
+        actualizar_gasto(gasto_id, foto_estado="error")
+
+def crear_backend():
+    if app.config["SUBIDAS_BACKEND"] == "local":
+        backend = SubidaLocal(os.path.join(app.config["SUBIDAS_DIR"], "tickets"), "/tickets")
+    else:
+        backend = SubidaCloudinary(lado_miniatura=app.config["IMAGEN_MINIATURA"])
+    medir = metricas.medido(f"subida_{app.config['SUBIDAS_BACKEND']}")
+    backend.subir = medir(backend.subir)
+    backend.miniatura = medir(backend.miniatura)
+    return backend
+
+@metricas.medido("procesar_imagen")
+def procesar_foto(ruta, miniatura=True):
+    return procesar_imagen(
+        ruta,
+        max_lado=app.config["IMAGEN_MAX_LADO"],
+        calidad=app.config["IMAGEN_CALIDAD"],
+        formato=app.config["IMAGEN_FORMATO"],
+        lado_miniatura=app.config["IMAGEN_MINIATURA"] if miniatura else None,
+    )
+
+cola_subidas = ColaSubidas(
+    crear_backend(),
+    os.path.join(app.config["SUBIDAS_DIR"], "spool"),
+    foto_subida,
+    foto_fallida,
+    procesar=procesar_foto,
+    workers=app.config["SUBIDAS_WORKERS"],
+    reintentos=app.config["SUBIDAS_REINTENTOS"],
+)
+
+@app.before_request
+def iniciar_subidas():
+    # Los hilos arrancan en el proceso que atiende peticiones, no al importar
+    # main (CLI, scripts, maestro de gunicorn --preload)
+    cola_subidas.iniciar()
+
+# -------------------------
+# UTILIDADES
+# -------------------------
+def parse_fecha(valor):
+    try:
+        return datetime.strptime(valor, "%Y-%m-%d").date() if valor else None
+    except ValueError:
+        return None
+
+def parse_cursor(valor):
+    """Cursor del listado de gastos: "AAAA-MM-DD_id" del último renglón visto."""
+    try:
+        fecha, gasto_id = valor.split("_")
+        return parse_fecha(fecha), int(gasto_id)
+    except (AttributeError, ValueError):
+        return None
+
+def parse_numero(valor):
+    try:
+        return float(valor) if valor not in (None, "") else 0.0
+    except ValueError:
+        return 0.0
+
+def filtro_gastos(obra_id, fecha=None, desde=None, hasta=None):
+    filtros = [Gasto.obra_id == obra_id] if obra_id else []
+    if fecha:
+        filtros.append(Gasto.fecha == fecha)
+    if desde:
+        filtros.append(Gasto.fecha >= desde)
+    if hasta:
+        filtros.append(Gasto.fecha <= hasta)
+    return filtros
 
 # -------------------------
 # RUTAS
@@ -70,12 +490,12 @@ def home():
 
 # -------- OBRAS ----------
 @app.route("/obras", methods=["GET", "POST"])
+@cache.vista("obra")
 def obras():
     if request.method == "POST":
         nombre = request.form["nombre"]
         if nombre:
-            db.session.add(Obra(nombre=nombre))
-            db.session.commit()
+            guardar(Obra(nombre=nombre))
             flash("Obra creada correctamente", "success")
         return redirect(url_for("obras"))
 
@@ -84,56 +504,429 @@ def obras():
 
 # -------- GASTOS ----------
 @app.route("/gastos", methods=["GET", "POST"])
+@cache.vista("obra", "gasto")
 def gastos():
-    obras = Obra.query.all()
-
     if request.method == "POST":
         obra_id = request.form["obra_id"]
         concepto = request.form["concepto"]
         monto = float(request.form["monto"])
         fecha = datetime.strptime(request.form["fecha"], "%Y-%m-%d").date()
 
-        foto_url = None
-        foto_public_id = None
-
-        file = request.files.get("foto")
-
-        if file and file.filename:
-            try:
-                resultado = cloudinary.uploader.upload(
-                    file,
-                    folder="construar/gastos",
-                    resource_type="image"
-                )
-                foto_url = resultado.get("secure_url")
-                foto_public_id = resultado.get("public_id")
-            except Exception as e:
-                print("ERROR CLOUDINARY:", e)
+        file = request.files.get("ticket")
+        con_foto = bool(file and file.filename)
 
         gasto = Gasto(
             obra_id=obra_id,
             concepto=concepto,
             monto=monto,
             fecha=fecha,
-            foto_url=foto_url,
-            foto_public_id=foto_public_id
+            foto_estado="pendiente" if con_foto else None
         )
 
-        db.session.add(gasto)
-        db.session.commit()
+        guardar(gasto)
+
+        if con_foto:
+            cola_subidas.guardar(gasto.id, file)
 
         flash("Gasto registrado correctamente", "success")
+        return redirect(url_for("gastos", obra_id=obra_id, fecha=request.form["fecha"]))
+
+    obras = db.session.execute(
+        db.select(Obra.id, Obra.nombre).order_by(Obra.nombre)
+    ).all()
+
+    obra_sel = None
+    obra_id = request.args.get("obra_id", type=int)
+    if obra_id:
+        obra_sel = db.session.get(Obra, obra_id)
+
+    fecha_sel = parse_fecha(request.args.get("fecha"))
+    desde = parse_fecha(request.args.get("desde"))
+    hasta = parse_fecha(request.args.get("hasta"))
+
+    lista = []
+    total = 0
+    siguiente = None
+
+    if obra_sel:
+        filtros = filtro_gastos(obra_sel.id, fecha_sel, desde, hasta)
+
+        total = db.session.execute(
+            db.select(func.coalesce(func.sum(Gasto.monto), 0)).where(*filtros)
+        ).scalar()
+
+        consulta = db.select(Gasto).where(*filtros)
+        cursor = parse_cursor(request.args.get("cursor"))
+        if cursor and cursor[0]:
+            c_fecha, c_id = cursor
+            consulta = consulta.where(or_(
+                Gasto.fecha < c_fecha,
+                and_(Gasto.fecha == c_fecha, Gasto.id < c_id),
+            ))
+
+        por_pagina = app.config["GASTOS_POR_PAGINA"]
+        lista = db.session.execute(
+            consulta.order_by(Gasto.fecha.desc(), Gasto.id.desc()).limit(por_pagina + 1)
+        ).scalars().all()
+
+        if len(lista) > por_pagina:
+            lista = lista[:por_pagina]
+            ultimo = lista[-1]
+            siguiente = f"{ultimo.fecha.strftime('%Y-%m-%d')}_{ultimo.id}"
+
+    return render_template(
+        "gastos.html",
+        gastos=lista,
+        obras=obras,
+        obra_sel=obra_sel,
+        fecha_sel=fecha_sel,
+        desde=desde,
+        hasta=hasta,
+        total=total,
+        siguiente=siguiente,
+        # La página sabe desde cuándo pedir cambios (ver static/offline.js)
+        sync_token=token_inicial(),
+    )
+
+# -------- IMPORTAR / EXPORTAR ----------
+@con_reintentos(db.session)
+def insertar_gastos(filas):
+    """Inserta un lote con un solo executemany y ajusta el resumen."""
+    db.session.execute(insert(Gasto), filas)
+    deltas = {}
+    for fila in filas:
+        _sumar(deltas, fila["obra_id"], "gastado", fila["monto"])
+        _sumar(deltas, fila["obra_id"], "gastos", 1)
+    ajustar_resumen(db.session.connection(), deltas)
+    db.session.commit()
+
+@app.route("/gastos/importar", methods=["POST"])
+def importar_gastos():
+    archivo = request.files.get("archivo")
+    if not archivo or not archivo.filename:
+        flash("Selecciona un archivo CSV o XLSX", "warning")
         return redirect(url_for("gastos"))
 
-    lista = Gasto.query.order_by(Gasto.fecha.desc()).all()
-    return render_template("gastos.html", gastos=lista, obras=obras)
+    obras_por_id = {}
+    obras_por_nombre = {}
+    for obra_id, nombre in db.session.execute(db.select(Obra.id, Obra.nombre)):
+        obras_por_id[obra_id] = nombre
+        obras_por_nombre[nombre] = obra_id
+
+    insertados = 0
+    errores = []
+    try:
+        for lote in leer_lotes(archivo.stream, archivo.filename, app.config["IMPORTAR_LOTE"]):
+            validas = []
+            for numero, fila in lote:
+                try:
+                    validas.append(validar_fila(fila, obras_por_id, obras_por_nombre))
+                except ValueError as e:
+                    errores.append(f"Fila {numero}: {e}")
+            if validas:
+                insertar_gastos(validas)
+                insertados += len(validas)
+    except ValueError as e:
+        # Los lotes anteriores ya se guardaron: hay que decirlo para que no
+        # se vuelva a importar el archivo completo
+        if insertados:
+            flash(f"{insertados} gastos importados antes del error", "warning")
+        flash(str(e), "warning")
+        if errores:
+            flash(f"{len(errores)} filas con errores: " + "; ".join(errores[:20]), "warning")
+        return redirect(url_for("gastos", obra_id=request.form.get("obra_id")))
+
+    flash(f"{insertados} gastos importados", "success")
+    if errores:
+        flash(f"{len(errores)} filas con errores: " + "; ".join(errores[:20]), "warning")
+    return redirect(url_for("gastos", obra_id=request.form.get("obra_id")))
+
+@app.route("/gastos/exportar")
+def exportar_gastos():
+    filtros = filtro_gastos(
+        request.args.get("obra_id", type=int),
+        parse_fecha(request.args.get("fecha")),
+        parse_fecha(request.args.get("desde")),
+        parse_fecha(request.args.get("hasta")),
+    )
+    consulta = (
+        db.select(Gasto.id, Gasto.fecha, Gasto.obra_id, Obra.nombre, Gasto.concepto, Gasto.monto, Gasto.foto_url)
+        .join(Obra, Obra.id == Gasto.obra_id)
+        .where(*filtros)
+        .order_by(Gasto.obra_id, Gasto.fecha, Gasto.id)
+    )
+
+    def generar():
+        # Cursor del lado del servidor: las filas se leen por bloques
+        # mientras se envían, sin armar el archivo completo en memoria.
+        with db.engine.connect() as conn:
+            resultado = conn.execution_options(stream_results=True, yield_per=1000).execute(consulta)
+            yield from csv_por_bloques(resultado, COLUMNAS_EXPORTACION)
+
+    nombre = f"gastos-{datetime.now().strftime('%Y%m%d-%H%M')}.csv"
+    return Response(
+        stream_with_context(generar()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'},
+    )
+
+# -------- SINCRONIZACIÓN (celular sin conexión) ----------
+def gasto_a_dict(g):
+    return {
+        "id": g.id,
+        "clave": g.clave,
+        "obra_id": g.obra_id,
+        "fecha": g.fecha.strftime("%Y-%m-%d"),
+        "concepto": g.concepto,
+        "monto": g.monto,
+        "foto_url": g.foto_url,
+        "foto_miniatura_url": g.foto_miniatura_url,
+        "foto_estado": g.foto_estado,
+    }
+
+def token_inicial():
+    """Token para empezar a sincronizar desde ahora (sin el historial)."""
+    tope = datetime.utcnow() - timedelta(seconds=app.config["SYNC_MARGEN"])
+    return f"{tope.isoformat()}_0"
+
+def parse_token(valor):
+    """Token de sincronización: "<actualizado ISO>_<id>" del último cambio entregado."""
+    try:
+        marca, gasto_id = valor.rsplit("_", 1)
+        return datetime.fromisoformat(marca), int(gasto_id)
+    except (AttributeError, ValueError):
+        return None
+
+@con_reintentos(db.session)
+def registrar_lote(filas, fotos):
+    """Inserta los gastos cuya clave aún no exista.
+
+    Regresa {clave: (id, duplicado)} y los ids nuevos que traen foto.
+    """
+    existentes = dict(db.session.execute(
+        db.select(Gasto.clave, Gasto.id).where(Gasto.clave.in_([f["clave"] for f in filas]))
+    ).all())
+
+    nuevos = {}
+    for fila in filas:
+        if fila["clave"] in existentes or fila["clave"] in nuevos:
+            continue
+        nuevos[fila["clave"]] = Gasto(
+            **fila,
+            foto_estado="pendiente" if fila["clave"] in fotos else None
+        )
+    db.session.add_all(nuevos.values())
+    db.session.flush()
+    ids = {clave: g.id for clave, g in nuevos.items()}
+    db.session.commit()
+
+    resultado = {clave: (gasto_id, True) for clave, gasto_id in existentes.items()}
+    resultado.update({clave: (gasto_id, False) for clave, gasto_id in ids.items()})
+    return resultado, {gasto_id: fotos[clave] for clave, gasto_id in ids.items() if clave in fotos}
+
+@app.route("/api/sync", methods=["POST"])
+def api_sync():
+    """Recibe los gastos capturados sin conexión y regresa los cambios nuevos.
+
+    Acepta JSON o multipart con el JSON en el campo "lote" y las fotos como
+    archivos "foto-<clave>". Los cambios solo se regresan para la obra
+    indicada en "obra_id"; sin token se empieza desde ahora, sin descargar
+    el historial.
+    """
+    try:
+        if request.is_json:
+            lote = request.get_json()
+        else:
+            lote = json.loads(request.form.get("lote") or "{}")
+    except ValueError:
+        return {"error": "el lote no es JSON válido"}, 400
+    if not isinstance(lote, dict) or not isinstance(lote.get("gastos", []), list):
+        return {"error": "se esperaba un objeto con una lista 'gastos'"}, 400
+    try:
+        obra_sync = int(lote["obra_id"]) if lote.get("obra_id") else None
+    except (ValueError, TypeError, OverflowError):
+        return {"error": f"obra_id inválido '{lote.get('obra_id')}'"}, 400
+
+    fotos = {
+        nombre.removeprefix("foto-"): archivo
+        for nombre, archivo in request.files.items()
+        if nombre.startswith("foto-") and archivo.filename
+    }
+
+    obras_por_id = {}
+    obras_por_nombre = {}
+    for obra_id, nombre in db.session.execute(db.select(Obra.id, Obra.nombre)):
+        obras_por_id[obra_id] = nombre
+        obras_por_nombre[nombre] = obra_id
+
+    validas = []
+    rechazados = []
+    for item in lote.get("gastos", []):
+        if not isinstance(item, dict):
+            rechazados.append({"clave": None, "error": "cada gasto debe ser un objeto"})
+            continue
+        clave = str(item.get("clave") or "")[:64]
+        if not clave:
+            rechazados.append({"clave": None, "error": "falta la clave"})
+            continue
+        try:
+            validas.append(dict(validar_fila(item, obras_por_id, obras_por_nombre), clave=clave))
+        except ValueError as e:
+            rechazados.append({"clave": clave, "error": str(e)})
+
+    aceptados = []
+    if validas:
+        try:
+            registrados, con_foto = registrar_lote(validas, fotos)
+        except IntegrityError:
+            # Lo normal es que otro envío con las mismas claves haya ganado la
+            # carrera: al repetir ya aparecen como existentes. Si vuelve a
+            # fallar es otra restricción y el lote no se puede guardar.
+            db.session.rollback()
+            try:
+                registrados, con_foto = registrar_lote(validas, fotos)
+            except IntegrityError as e:
+                db.session.rollback()
+                app.logger.error("Lote de sincronización rechazado: %s", e)
+                return {"error": "el lote no se pudo guardar"}, 400
+        for gasto_id, archivo in con_foto.items():
+            cola_subidas.guardar(gasto_id, archivo)
+        aceptados = [
+            {"clave": clave, "id": gasto_id, "duplicado": duplicado}
+            for clave, (gasto_id, duplicado) in registrados.items()
+        ]
+
+    # Cambios de la obra desde el último token, en orden (actualizado, id)
+    cambios = []
+    mas = False
+    nuevo_token = None
+    if obra_sync:
+        limite = app.config["SYNC_LIMITE"]
+        tope = datetime.utcnow() - timedelta(seconds=app.config["SYNC_MARGEN"])
+        token = parse_token(lote.get("token"))
+        if token:
+            marca, gasto_id = token
+            cambios = db.session.execute(
+                db.select(Gasto)
+                .where(
+                    Gasto.obra_id == obra_sync,
+                    Gasto.actualizado <= tope,
+                    or_(
+                        Gasto.actualizado > marca,
+                        and_(Gasto.actualizado == marca, Gasto.id > gasto_id),
+                    ),
+                )
+                .order_by(Gasto.actualizado, Gasto.id)
+                .limit(limite + 1)
+            ).scalars().all()
+            mas = len(cambios) > limite
+            cambios = cambios[:limite]
+            nuevo_token = lote.get("token")
+        else:
+            # El listado ya muestra lo anterior; solo interesan cambios nuevos
+            nuevo_token = token_inicial()
+        if cambios:
+            nuevo_token = f"{cambios[-1].actualizado.isoformat()}_{cambios[-1].id}"
+
+    return {
+        "aceptados": aceptados,
+        "rechazados": rechazados,
+        "cambios": [gasto_a_dict(g) for g in cambios],
+        "token": nuevo_token,
+        "mas": mas,
+    }
+
+@app.route("/sw.js")
+def service_worker():
+    # Servido desde la raíz para que su alcance cubra toda la app
+    respuesta = send_from_directory(app.static_folder, "sw.js", mimetype="application/javascript")
+    respuesta.headers["Cache-Control"] = "no-cache"
+    return respuesta
+
+# -------- PRESUPUESTO ----------
+@app.route("/presupuesto", methods=["GET", "POST"])
+@cache.vista("obra", "partida_presupuesto", "resumen_obra")
+def presupuesto():
+    if request.method == "POST":
+        obra_id = request.form["obra_id"]
+        guardar(PartidaPresupuesto(
+            obra_id=obra_id,
+            partida=request.form["partida"],
+            descripcion=request.form["descripcion"],
+            cantidad=parse_numero(request.form.get("cantidad")),
+            precio_unitario=parse_numero(request.form.get("precio_unitario")),
+        ))
+        flash("Partida agregada correctamente", "success")
+        return redirect(url_for("presupuesto", obra_id=obra_id))
+
+    obras = db.session.execute(
+        db.select(Obra.id, Obra.nombre).order_by(Obra.nombre)
+    ).all()
+
+    obra_sel = None
+    obra_id = request.args.get("obra_id", type=int)
+    if obra_id:
+        obra_sel = db.session.get(Obra, obra_id)
+
+    partidas = []
+    total = 0
+    if obra_sel:
+        partidas = db.session.execute(
+            db.select(PartidaPresupuesto)
+            .where(PartidaPresupuesto.obra_id == obra_sel.id)
+            .order_by(PartidaPresupuesto.id)
+        ).scalars().all()
+        resumen = db.session.get(ResumenObra, obra_sel.id)
+        total = resumen.total_presupuesto if resumen else 0
+
+    return render_template("presupuesto.html", obras=obras, obra_sel=obra_sel, partidas=partidas, total=total)
+
+# -------- DASHBOARD ----------
+@app.route("/dashboard")
+@cache.vista("obra", "gasto", "partida_presupuesto", "resumen_obra")
+def dashboard():
+    # Lee el resumen materializado: una fila por obra, sin recorrer gastos
+    filas = []
+    for nombre, pres, gas in db.session.execute(
+        db.select(
+            Obra.nombre,
+            func.coalesce(ResumenObra.total_presupuesto, 0),
+            func.coalesce(ResumenObra.total_gastado, 0),
+        )
+        .outerjoin(ResumenObra, ResumenObra.obra_id == Obra.id)
+        .order_by(Obra.nombre)
+    ):
+        filas.append({
+            "obra": nombre,
+            "presupuesto": pres,
+            "gastos": gas,
+            "diferencia": pres - gas,
+            "avance": gas / pres * 100 if pres else 0,
+        })
+
+    total_pres = sum(f["presupuesto"] for f in filas)
+    total_gas = sum(f["gastos"] for f in filas)
+
+    return render_template(
+        "dashboard.html",
+        filas=filas,
+        total_pres=total_pres,
+        total_gas=total_gas,
+        total_diff=total_pres - total_gas,
+        total_avance=total_gas / total_pres * 100 if total_pres else 0,
+    )
+
+# -------- TICKETS (backend local) ----------
+@app.route("/tickets/<path:nombre>")
+def ticket_local(nombre):
+    return send_from_directory(os.path.join(app.config["SUBIDAS_DIR"], "tickets"), nombre)
 
 # -------------------------
 # ERRORES
 # -------------------------
 @app.errorhandler(413)
 def archivo_muy_grande(e):
-    return "La imagen supera el límite de 3 MB", 413
+    return f"La imagen supera el límite de {app.config['MAX_SUBIDA_MB']} MB", 413
 
 @app.errorhandler(500)
 def error_servidor(e):
@@ -0,0 +1,247 @@
+"""Medición por petición: SQL, plantillas y llamadas externas.
+
+Cada petición acumula cuántas consultas SQL hizo y cuánto tardaron (eventos
+del motor de SQLAlchemy), el tiempo de render de plantillas y el de llamadas
+externas (Cloudinary, procesamiento de imágenes). El desglose se envía en el
+encabezado Server-Timing y se agrega en /metrics con formato de texto de
+Prometheus. Con gunicorn cada worker expone sus propios números.
+
+Perfilado opcional: con PERFIL_MUESTREO > 0 se perfila esa fracción de las
+peticiones con cProfile y se guarda el .prof de las que tarden más de
+PERFIL_LENTO_MS en PERFIL_DIR (abrir con `python -m pstats` o snakeviz).
+"""
+import cProfile
+import functools
+import logging
+import os
+import random
+import threading
+import time
+
+from flask import Response, g, has_app_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+CUBETAS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _etiquetas(nombres, valores):
+    if not nombres:
+        return ""
+    pares = ",".join(
+        '{}="{}"'.format(n, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for n, v in zip(nombres, valores)
+    )
+    return "{" + pares + "}"
+
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def sumar(self, *etiquetas, valor=1):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def exponer(self):
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} counter"
+        with self._lock:
+            for etiquetas, valor in sorted(self._valores.items()):
+                yield f"{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {valor}"
+
+
+class Histograma:
+    def __init__(self, nombre, ayuda, etiquetas=(), cubetas=CUBETAS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.cubetas = cubetas
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *etiquetas):
+        with self._lock:
+            serie = self._series.setdefault(etiquetas, [[0] * len(self.cubetas), 0.0, 0])
+            for i, limite in enumerate(self.cubetas):
+                if valor <= limite:
+                    serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exponer(self):
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} histogram"
+        nombres = (*self.etiquetas, "le")
+        with self._lock:
+            for etiquetas, (conteos, suma, total) in sorted(self._series.items()):
+                for limite, conteo in zip(self.cubetas, conteos):
+                    yield f"{self.nombre}_bucket{_etiquetas(nombres, (*etiquetas, limite))} {conteo}"
+                yield f"{self.nombre}_bucket{_etiquetas(nombres, (*etiquetas, '+Inf'))} {total}"
+                yield f"{self.nombre}_sum{_etiquetas(self.etiquetas, etiquetas)} {suma}"
+                yield f"{self.nombre}_count{_etiquetas(self.etiquetas, etiquetas)} {total}"
+
+
+class Metricas:
+    def __init__(self):
+        self.peticiones = Histograma(
+            "http_request_duration_seconds", "Duración de las peticiones", ("endpoint", "metodo", "estado"))
+        self.consultas = Histograma(
+            "db_query_duration_seconds", "Duración de cada consulta SQL", ("endpoint",))
+        self.consultas_por_peticion = Histograma(
+            "db_queries_per_request", "Consultas SQL por petición", ("endpoint",),
+            cubetas=(1, 2, 5, 10, 20, 50, 100, 250))
+        self.plantillas = Histograma(
+            "template_render_seconds", "Tiempo de render por plantilla", ("plantilla",))
+        self.externos = Histograma(
+            "external_call_seconds", "Llamadas externas (subidas, imágenes)", ("servicio",))
+        self.errores_externos = Contador(
+            "external_call_errors_total", "Llamadas externas que fallaron", ("servicio",))
+        self.perfiles = Contador("slow_request_profiles_total", "Perfiles guardados de peticiones lentas")
+
+        self._perfilando = threading.Lock()
+
+    # -------------------------
+    # REGISTRO
+    # -------------------------
+    def init_app(self, app, engine):
+        app.config.setdefault("METRICAS_NMAS1", 30)
+        app.config.setdefault("PERFIL_MUESTREO", 0.0)
+        app.config.setdefault("PERFIL_LENTO_MS", 500)
+        app.config.setdefault("PERFIL_DIR", os.path.join(app.instance_path, "perfiles"))
+        self.app = app
+
+        event.listen(engine, "before_cursor_execute", self._antes_sql)
+        event.listen(engine, "after_cursor_execute", self._despues_sql)
+        event.listen(engine, "handle_error", self._error_sql)
+        before_render_template.connect(self._antes_plantilla, app)
+        template_rendered.connect(self._despues_plantilla, app)
+        app.before_request(self._inicio)
+        app.after_request(self._fin)
+        app.teardown_request(self._limpiar)
+        app.add_url_rule("/metrics", "metrics", self.exponer)
+
+    @staticmethod
+    def _actual():
+        return g.get("_metricas") if has_app_context() else None
+
+    def _inicio(self):
+        g._metricas = {"inicio": time.perf_counter(), "sql": 0.0, "sql_n": 0,
+                       "tpl": 0.0, "tpl_inicio": [], "ext": 0.0, "perfil": None}
+        muestreo = self.app.config["PERFIL_MUESTREO"]
+        # cProfile solo admite un perfil activo a la vez
+        if muestreo and random.random() < muestreo and self._perfilando.acquire(blocking=False):
+            perfil = cProfile.Profile()
+            perfil.enable()
+            g._metricas["perfil"] = perfil
+
+    def _fin(self, respuesta):
+        m = g.pop("_metricas", None)
+        if m is None:
+            return respuesta
+        duracion = time.perf_counter() - m["inicio"]
+        endpoint = request.endpoint or "desconocido"
+
+        if m["perfil"]:
+            self._guardar_perfil(m["perfil"], duracion, endpoint)
+
+        self.peticiones.observar(duracion, endpoint, request.method, respuesta.status_code)
+        self.consultas_por_peticion.observar(m["sql_n"], endpoint)
+        if m["sql_n"] > self.app.config["METRICAS_NMAS1"]:
+            log.warning("%s hizo %d consultas SQL (¿N+1?)", endpoint, m["sql_n"])
+
+        respuesta.headers["Server-Timing"] = ", ".join([
+            f'db;dur={m["sql"] * 1000:.1f};desc="{m["sql_n"]} consultas"',
+            f'tpl;dur={m["tpl"] * 1000:.1f}',
+            f'ext;dur={m["ext"] * 1000:.1f}',
+            f'total;dur={duracion * 1000:.1f}',
+        ])
+        return respuesta
+
+    def _limpiar(self, error=None):
+        # Si la petición terminó sin pasar por after_request
+        m = g.pop("_metricas", None)
+        if m and m["perfil"]:
+            m["perfil"].disable()
+            self._perfilando.release()
+
+    def _guardar_perfil(self, perfil, duracion, endpoint):
+        try:
+            perfil.disable()
+            if duracion * 1000 >= self.app.config["PERFIL_LENTO_MS"]:
+                os.makedirs(self.app.config["PERFIL_DIR"], exist_ok=True)
+                nombre = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{duracion * 1000:.0f}ms.prof"
+                perfil.dump_stats(os.path.join(self.app.config["PERFIL_DIR"], nombre))
+                self.perfiles.sumar()
+        finally:
+            self._perfilando.release()
+
+    # -------------------------
+    # SQL Y PLANTILLAS
+    # -------------------------
+    def _antes_sql(self, conn, cursor, sentencia, parametros, contexto, executemany):
+        conn.info.setdefault("_metricas_sql", []).append(time.perf_counter())
+
+    def _despues_sql(self, conn, cursor, sentencia, parametros, contexto, executemany):
+        duracion = time.perf_counter() - conn.info["_metricas_sql"].pop()
+        m = self._actual()
+        endpoint = request.endpoint if m is not None else "fuera_de_peticion"
+        self.consultas.observar(duracion, endpoint or "desconocido")
+        if m is not None:
+            m["sql"] += duracion
+            m["sql_n"] += 1
+
+    def _error_sql(self, contexto):
+        if contexto.connection is not None and contexto.connection.info.get("_metricas_sql"):
+            contexto.connection.info["_metricas_sql"].pop()
+
+    def _antes_plantilla(self, app, template, context, **extra):
+        m = self._actual()
+        if m is not None:
+            m["tpl_inicio"].append(time.perf_counter())
+
+    def _despues_plantilla(self, app, template, context, **extra):
+        m = self._actual()
+        if m is not None and m["tpl_inicio"]:
+            duracion = time.perf_counter() - m["tpl_inicio"].pop()
+            m["tpl"] += duracion
+            self.plantillas.observar(duracion, template.name)
+
+    # -------------------------
+    # LLAMADAS EXTERNAS
+    # -------------------------
+    def medido(self, servicio):
+        """Decorador que mide una llamada externa (también fuera de peticiones)."""
+        def decorador(fn):
+            @functools.wraps(fn)
+            def envoltura(*args, **kwargs):
+                inicio = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                except Exception:
+                    self.errores_externos.sumar(servicio)
+                    raise
+                finally:
+                    duracion = time.perf_counter() - inicio
+                    self.externos.observar(duracion, servicio)
+                    m = self._actual()
+                    if m is not None:
+                        m["ext"] += duracion
+            return envoltura
+        return decorador
+
+    # -------------------------
+    # /metrics
+    # -------------------------
+    def exponer(self):
+        lineas = []
+        for metrica in (self.peticiones, self.consultas, self.consultas_por_peticion,
+                        self.plantillas, self.externos, self.errores_externos, self.perfiles):
+            lineas.extend(metrica.exponer())
+        return Response("\n".join(lineas) + "\n", mimetype="text/plain; version=0.0.4")
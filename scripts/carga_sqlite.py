@@ -0,0 +1,118 @@
+"""Prueba de carga: N escritores concurrentes sobre un mismo archivo SQLite.
+
+Compara la configuración por omisión contra la de basedatos.py (WAL, PRAGMAs
+y reintentos). Cada escritor es un proceso, como un worker de gunicorn, y
+cada transacción imita la captura de un gasto: lee el total de la obra,
+inserta el gasto y actualiza el resumen.
+
+    python scripts/carga_sqlite.py --escritores 8 --transacciones 200
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from basedatos import con_reintentos, configurar_pragmas, es_bloqueo, opciones_motor  # noqa: E402
+
+ESQUEMA = [
+    "CREATE TABLE gasto (id INTEGER PRIMARY KEY, obra_id INTEGER NOT NULL, "
+    "concepto VARCHAR(200) NOT NULL, monto FLOAT NOT NULL, fecha DATE NOT NULL)",
+    "CREATE INDEX ix_gasto_obra_fecha ON gasto (obra_id, fecha, id)",
+    "CREATE TABLE resumen_obra (obra_id INTEGER PRIMARY KEY, total_gastado FLOAT NOT NULL, num_gastos INTEGER NOT NULL)",
+]
+OBRAS = 20
+
+
+def crear_base(ruta):
+    engine = create_engine(f"sqlite:///{ruta}")
+    with engine.begin() as conn:
+        for sql in ESQUEMA:
+            conn.execute(text(sql))
+        conn.execute(
+            text("INSERT INTO resumen_obra VALUES (:o, 0, 0)"),
+            [{"o": o} for o in range(OBRAS)],
+        )
+    engine.dispose()
+
+
+def capturar(session, n, obra_id):
+    session.execute(text("SELECT SUM(monto) FROM gasto WHERE obra_id = :o"), {"o": obra_id})
+    session.execute(
+        text("INSERT INTO gasto (obra_id, concepto, monto, fecha) VALUES (:o, :c, :m, DATE('now'))"),
+        {"o": obra_id, "c": f"gasto {n}", "m": 100.0},
+    )
+    session.execute(
+        text("UPDATE resumen_obra SET total_gastado = total_gastado + 100, num_gastos = num_gastos + 1 "
+             "WHERE obra_id = :o"),
+        {"o": obra_id},
+    )
+    session.commit()
+
+
+def escritor(ruta, modo, transacciones, semilla, resultados):
+    if modo == "optimizado":
+        engine = create_engine(f"sqlite:///{ruta}", **opciones_motor())
+        configurar_pragmas(engine)
+    else:
+        engine = create_engine(f"sqlite:///{ruta}")
+
+    session = Session(engine)
+    paso = capturar if modo != "optimizado" else con_reintentos(session)(capturar)
+    ok = errores = 0
+    for n in range(transacciones):
+        try:
+            paso(session, n, (semilla + n) % OBRAS)
+            ok += 1
+        except Exception as e:
+            session.rollback()
+            if not es_bloqueo(e):
+                raise
+            errores += 1
+    session.close()
+    engine.dispose()
+    resultados.put((ok, errores))
+
+
+def correr(modo, escritores, transacciones):
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, "carga.db")
+        crear_base(ruta)
+        resultados = multiprocessing.Queue()
+        procesos = [
+            multiprocessing.Process(target=escritor, args=(ruta, modo, transacciones, i, resultados))
+            for i in range(escritores)
+        ]
+        inicio = time.perf_counter()
+        for p in procesos:
+            p.start()
+        totales = [resultados.get() for _ in procesos]
+        for p in procesos:
+            p.join()
+        duracion = time.perf_counter() - inicio
+
+    ok = sum(t[0] for t in totales)
+    errores = sum(t[1] for t in totales)
+    print(f"{modo:>11}: {ok:6d} commits, {errores:5d} 'database is locked', "
+          f"{duracion:7.2f}s, {ok / duracion:8.1f} tx/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--escritores", type=int, default=8)
+    parser.add_argument("--transacciones", type=int, default=200, help="por escritor")
+    args = parser.parse_args()
+
+    print(f"{args.escritores} escritores x {args.transacciones} transacciones")
+    for modo in ("por_omision", "optimizado"):
+        correr(modo, args.escritores, args.transacciones)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+// Captura de gastos en el celular con conexión mala o nula.
+//
+// Cada gasto se guarda primero en IndexedDB con una clave generada en el
+// celular y enseguida se intenta enviar a /api/sync con un tiempo límite. Si
+// la red falla o no responde, se queda en la cola y se reenvía al volver la
+// conexión (evento "online" o Background Sync). El servidor ignora las claves
+// que ya recibió, así que reenviar es seguro.
+//
+// La página no se recarga: los gastos aceptados se agregan a la tabla y la
+// respuesta trae solo los gastos de la obra que cambiaron desde el token con
+// el que se generó la página, que se aplican en su lugar.
+//
+// Este archivo se carga tanto en la página como en el service worker.
+(function (global) {
+  const DB_NOMBRE = "construar";
+  const DB_VERSION = 2;
+  const TIEMPO_LIMITE_MS = 20000;
+
+  function abrir() {
+    return new Promise((ok, falla) => {
+      const req = indexedDB.open(DB_NOMBRE, DB_VERSION);
+      req.onupgradeneeded = () => {
+        const db = req.result;
+        if (!db.objectStoreNames.contains("pendientes")) {
+          db.createObjectStore("pendientes", {keyPath: "clave"});
+        }
+        // La versión 1 guardaba aquí cambios y tokens que nada leía
+        ["gastos", "meta"].forEach((n) => {
+          if (db.objectStoreNames.contains(n)) db.deleteObjectStore(n);
+        });
+      };
+      req.onsuccess = () => ok(req.result);
+      req.onerror = () => falla(req.error);
+    });
+  }
+
+  async function pedir(almacen, modo, accion) {
+    const db = await abrir();
+    return new Promise((ok, falla) => {
+      const tx = db.transaction(almacen, modo);
+      const req = accion(tx.objectStore(almacen));
+      tx.oncomplete = () => ok(req ? req.result : undefined);
+      tx.onerror = tx.onabort = () => falla(tx.error);
+    });
+  }
+
+  async function encolar(gasto, foto) {
+    const item = Object.assign({}, gasto, {clave: crypto.randomUUID(), foto: foto || null, error: null});
+    await pedir("pendientes", "readwrite", (s) => s.put(item));
+    return item;
+  }
+
+  function pendientes() {
+    return pedir("pendientes", "readonly", (s) => s.getAll());
+  }
+
+  // Con señal débil fetch puede quedarse colgado: se aborta y el gasto
+  // sigue en la cola.
+  async function conLimite(url, opciones) {
+    const control = new AbortController();
+    const reloj = setTimeout(() => control.abort(), TIEMPO_LIMITE_MS);
+    try {
+      return await fetch(url, Object.assign({signal: control.signal}, opciones));
+    } finally {
+      clearTimeout(reloj);
+    }
+  }
+
+  // Envía la cola. Con `pagina` ({obraId, token}) además descarga los
+  // cambios de esa obra desde pagina.token y lo avanza. Sin nada que enviar
+  // ni descargar no hace ninguna petición.
+  async function enviar(pagina) {
+    let lista = (await pendientes()).filter((g) => !g.error);
+    const descargar = Boolean(pagina && pagina.obraId && pagina.token);
+    const resultado = {aceptados: [], cambios: []};
+    let mas = lista.length > 0 || descargar;
+
+    while (mas) {
+      const datos = new FormData();
+      const gastos = lista.map((g) => {
+        if (g.foto) datos.append("foto-" + g.clave, g.foto, g.foto.name || g.clave + ".jpg");
+        return {clave: g.clave, obra_id: g.obra_id, fecha: g.fecha, concepto: g.concepto, monto: g.monto};
+      });
+      datos.append("lote", JSON.stringify({
+        obra_id: descargar ? pagina.obraId : null,
+        token: descargar ? pagina.token : null,
+        gastos: gastos,
+      }));
+
+      const resp = await conLimite("/api/sync", {method: "POST", body: datos, credentials: "same-origin"});
+      if (!resp.ok) throw new Error("Sincronización falló: " + resp.status);
+      const r = await resp.json();
+
+      await pedir("pendientes", "readwrite", (s) => {
+        r.aceptados.forEach((a) => s.delete(a.clave));
+        // Los rechazados se conservan para revisarlos, pero no se reenvían
+        r.rechazados.forEach((x) => {
+          const item = lista.find((g) => g.clave === x.clave);
+          if (item) s.put(Object.assign(item, {error: x.error}));
+        });
+      });
+      r.aceptados.forEach((a) => {
+        const item = lista.find((g) => g.clave === a.clave);
+        if (item) resultado.aceptados.push(Object.assign({}, item, {id: a.id, duplicado: a.duplicado}));
+      });
+      resultado.cambios.push(...r.cambios);
+      if (descargar && r.token) pagina.token = r.token;
+
+      // Las siguientes vueltas solo descargan cambios
+      lista = [];
+      mas = descargar && r.mas;
+    }
+    return resultado;
+  }
+
+  // Una sincronización a la vez; la siguiente espera a que termine la
+  // anterior para incluir lo que se haya encolado mientras tanto.
+  let cadena = Promise.resolve();
+  function sincronizar(pagina) {
+    const vuelta = cadena.then(() => enviar(pagina));
+    cadena = vuelta.catch(() => {});
+    return vuelta;
+  }
+
+  global.ConstruarOffline = {encolar, pendientes, sincronizar};
+
+  if (typeof document === "undefined") return;
+
+  // -------- Página ----------
+  if ("serviceWorker" in navigator) {
+    navigator.serviceWorker.register("/sw.js");
+  }
+
+  const tabla = document.getElementById("lista-gastos");
+  const pagina = tabla ? {obraId: tabla.dataset.obra, token: tabla.dataset.token} : null;
+
+  function coincide(g) {
+    const f = tabla.dataset;
+    return String(g.obra_id) === f.obra &&
+      (!f.fecha || g.fecha === f.fecha) &&
+      (!f.desde || g.fecha >= f.desde) &&
+      (!f.hasta || g.fecha <= f.hasta);
+  }
+
+  function celda(fila, texto, clase) {
+    const td = fila.insertCell();
+    if (clase) {
+      const span = document.createElement("span");
+      span.className = clase;
+      span.textContent = texto;
+      td.appendChild(span);
+    } else {
+      td.textContent = texto;
+    }
+    return td;
+  }
+
+  function crearFila(g) {
+    const fila = document.createElement("tr");
+    fila.dataset.id = g.id;
+    fila.dataset.fecha = g.fecha;
+    fila.dataset.monto = g.monto;
+    celda(fila, g.fecha);
+    celda(fila, g.concepto);
+    celda(fila, "-");
+    celda(fila, Number(g.monto).toFixed(2));
+    celda(fila, "-");
+    if (g.foto_url) {
+      const enlace = document.createElement("a");
+      enlace.href = g.foto_url;
+      enlace.target = "_blank";
+      const img = document.createElement("img");
+      img.className = "img";
+      img.src = g.foto_miniatura_url || g.foto_url;
+      img.alt = "ticket";
+      img.loading = "lazy";
+      enlace.appendChild(img);
+      fila.insertCell().appendChild(enlace);
+    } else if (g.foto_estado === "pendiente") {
+      celda(fila, "Subiendo foto…", "muted");
+    } else if (g.foto_estado === "error") {
+      celda(fila, "No se pudo subir la foto", "muted");
+    } else {
+      celda(fila, "Sin foto", "muted");
+    }
+    const editar = document.createElement("a");
+    editar.href = "/gastos/" + g.id + "/editar";
+    editar.textContent = "Editar";
+    fila.insertCell().appendChild(editar);
+    return fila;
+  }
+
+  // Inserta o reemplaza el renglón del gasto respetando el orden
+  // (fecha, id) descendente y los filtros de la página.
+  function aplicar(g) {
+    const cuerpo = tabla.tBodies[0];
+    const actual = cuerpo.querySelector('tr[data-id="' + g.id + '"]');
+    let delta = 0;
+    if (actual) {
+      delta -= parseFloat(actual.dataset.monto);
+      actual.remove();
+    }
+    if (coincide(g)) {
+      const antes = Array.from(cuerpo.rows).find((tr) => tr.dataset.id &&
+        (tr.dataset.fecha < g.fecha || (tr.dataset.fecha === g.fecha && Number(tr.dataset.id) < g.id)));
+      // Más antiguo que todo lo visible y hay más páginas: le toca a otra
+      if (antes || !("hayMas" in tabla.dataset)) {
+        cuerpo.insertBefore(crearFila(g), antes || null);
+      }
+      delta += Number(g.monto);
+    }
+    const vacio = cuerpo.querySelector("tr[data-vacio]");
+    if (vacio) vacio.hidden = cuerpo.querySelector("tr[data-id]") !== null;
+    const total = document.getElementById("total-filtrado");
+    if (total && delta) {
+      total.dataset.total = parseFloat(total.dataset.total) + delta;
+      total.textContent = parseFloat(total.dataset.total).toFixed(2);
+    }
+  }
+
+  async function mostrarPendientes() {
+    const aviso = document.getElementById("pendientes");
+    if (!aviso) return;
+    const lista = await pendientes();
+    const conError = lista.filter((g) => g.error).length;
+    aviso.hidden = lista.length === 0;
+    aviso.textContent = lista.length + " gasto(s) guardados en el celular, pendientes de enviar" +
+      (conError ? " (" + conError + " con error)" : "") + ".";
+  }
+
+  async function sincronizarPagina() {
+    try {
+      const r = await sincronizar(pagina);
+      if (tabla) {
+        r.aceptados.forEach((a) => aplicar({
+          id: a.id, obra_id: a.obra_id, fecha: a.fecha, concepto: a.concepto,
+          monto: parseFloat(a.monto), foto_estado: a.foto ? "pendiente" : null,
+        }));
+        r.cambios.forEach(aplicar);
+      }
+    } catch (e) {
+      // Sin red o sin respuesta: se reintenta con "online" o Background Sync
+      if ("serviceWorker" in navigator) {
+        const reg = await navigator.serviceWorker.ready;
+        if (reg.sync) reg.sync.register("gastos").catch(() => {});
+      }
+    }
+    mostrarPendientes();
+  }
+
+  // Siempre se intercepta el envío: navigator.onLine es true con señal
+  // débil y un POST normal que falla se perdería.
+  document.querySelectorAll("form[data-offline]").forEach((form) => {
+    form.addEventListener("submit", async (ev) => {
+      ev.preventDefault();
+      const campos = new FormData(form);
+      const foto = form.querySelector("input[type=file]");
+      await encolar({
+        obra_id: campos.get("obra_id"),
+        fecha: campos.get("fecha"),
+        concepto: campos.get("concepto"),
+        monto: campos.get("monto") || "0",
+      }, foto && foto.files[0]);
+      form.querySelectorAll("input[name=concepto], input[name=monto], input[type=file]").forEach((i) => { i.value = ""; });
+      mostrarPendientes();
+      sincronizarPagina();
+    });
+  });
+
+  // Al volver la red se envía la cola y se actualiza la lista, que pudo
+  // quedarse vieja mientras no había conexión.
+  window.addEventListener("online", sincronizarPagina);
+  mostrarPendientes();
+  pendientes().then((lista) => {
+    if (navigator.onLine && lista.some((g) => !g.error)) sincronizarPagina();
+  });
+})(self);
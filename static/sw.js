@@ -0,0 +1,62 @@
+// Service worker: guarda las páginas para abrirlas sin conexión y envía la
+// cola de gastos con Background Sync cuando regresa la red.
+//
+// Al cambiar algo en la lista BASE o en este archivo hay que subir la versión
+// de CACHE: así el navegador instala el service worker nuevo y descarta la
+// caché anterior. Los archivos de /static/ además se revalidan en cada uso.
+importScripts("/static/offline.js");
+
+const CACHE = "construar-v2";
+const BASE = ["/", "/gastos", "/static/offline.js"];
+
+self.addEventListener("install", (ev) => {
+  ev.waitUntil(caches.open(CACHE).then((c) => c.addAll(BASE)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener("activate", (ev) => {
+  ev.waitUntil(
+    caches.keys()
+      .then((nombres) => Promise.all(nombres.filter((n) => n !== CACHE).map((n) => caches.delete(n))))
+      .then(() => self.clients.claim())
+  );
+});
+
+self.addEventListener("fetch", (ev) => {
+  const req = ev.request;
+  const url = new URL(req.url);
+  if (req.method !== "GET" || url.origin !== location.origin || url.pathname.startsWith("/api/")) return;
+
+  // Estáticos: se responde con la copia guardada (rápido con mala señal) y
+  // en paralelo se descarga la versión actual para la siguiente vez.
+  if (url.pathname.startsWith("/static/")) {
+    const red = fetch(req).then((resp) => {
+      if (resp.ok) {
+        const copia = resp.clone();
+        caches.open(CACHE).then((c) => c.put(req, copia));
+      }
+      return resp;
+    });
+    ev.waitUntil(red.catch(() => {}));
+    ev.respondWith(caches.match(req).then((r) => r || red));
+    return;
+  }
+
+  // Páginas: primero la red; sin conexión, la última copia guardada
+  ev.respondWith(
+    fetch(req)
+      .then((resp) => {
+        if (resp.ok) {
+          const copia = resp.clone();
+          caches.open(CACHE).then((c) => c.put(req, copia));
+        }
+        return resp;
+      })
+      .catch(() => caches.match(req).then((r) => r || caches.match(req, {ignoreSearch: true})))
+  );
+});
+
+self.addEventListener("sync", (ev) => {
+  if (ev.tag === "gastos") {
+    ev.waitUntil(self.ConstruarOffline.sincronizar());
+  }
+});
@@ -0,0 +1,319 @@
+"""Subida de fotos de tickets fuera del hilo de la petición.
+
+La vista guarda el gasto de inmediato con la foto en estado "pendiente" y deja
+los bytes en un directorio de spool. Un grupo acotado de hilos sube cada
+archivo al backend configurado, con reintentos y espera exponencial, y avisa
+al terminar para que se llenen foto_url / foto_public_id.
+
+Antes de subir, una etapa opcional (procesar) puede recomprimir la imagen y
+generar una miniatura (solo si el backend la necesita como archivo, ver
+`miniatura_local`); si falla se sube el original tal cual. Si lo que
+falla es solo la miniatura, el gasto se queda con la foto y sin miniatura.
+
+El directorio de spool es la cola real: la cola en memoria solo acelera el
+caso común. Cada archivo se "toma" renombrándolo (operación atómica), así que
+varios workers de gunicorn pueden compartir el mismo directorio sin subir dos
+veces la misma foto, y lo que quede pendiente tras un reinicio se retoma.
+
+Estados en el spool (sufijos):
+- sin sufijo: pendiente de subir.
+- .subiendo: tomado por un hilo; si se queda así más de `vencido` segundos
+  (proceso muerto) la revisión periódica lo libera.
+- .error: agotó los reintentos; se vuelve a intentar cada `reintentar_cada`
+  segundos, hasta `rondas` veces, y después se descarta.
+- .subida: ya está en el backend pero el aviso (al_terminar) falló, p. ej.
+  con la base bloqueada; se guarda el resultado y solo se repite el aviso,
+  sin volver a subir la foto.
+"""
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+
+import cloudinary.uploader
+
+log = logging.getLogger(__name__)
+
+PREFIJO = "gasto-"
+TOMADO = ".subiendo"
+FALLIDO = ".error"
+SUBIDA = ".subida"
+TEMPORAL = ".tmp"
+# Extensiones que se conservan en el spool; cualquier otra (p. ej. ".tmp" o
+# ".error" en el nombre del cliente) chocaría con los sufijos de estado.
+EXTENSIONES = (".jpg", ".jpeg", ".png", ".webp", ".heic")
+
+
+def _gasto_id(nombre):
+    # gasto-<id>.jpg o gasto-<id>-r<ronda>.jpg
+    return int(nombre.removeprefix(PREFIJO).split(".")[0].split("-")[0])
+
+
+def _ronda(nombre):
+    base = nombre.removeprefix(PREFIJO).split(".")[0]
+    return int(base.split("-r")[1]) if "-r" in base else 0
+
+
+# -------------------------
+# BACKENDS
+# -------------------------
+class SubidaCloudinary:
+    # La miniatura es una transformación de la foto subida: no hace falta
+    # generarla en el servidor
+    miniatura_local = False
+
+    def __init__(self, carpeta="construar/gastos", lado_miniatura=280):
+        self.carpeta = carpeta
+        self.lado_miniatura = lado_miniatura
+
+    def subir(self, ruta):
+        resultado = cloudinary.uploader.upload(
+            ruta,
+            folder=self.carpeta,
+            resource_type="image"
+        )
+        return resultado.get("secure_url"), resultado.get("public_id")
+
+    def miniatura(self, ruta, public_id):
+        # Transformación sobre la foto ya subida: no crea un segundo asset
+        # que habría que borrar aparte.
+        lado = self.lado_miniatura
+        return cloudinary.CloudinaryImage(public_id).build_url(
+            width=lado, height=lado, crop="limit", secure=True
+        )
+
+
+class SubidaLocal:
+    """Sustituto de Cloudinary: copia el archivo a un directorio local."""
+
+    miniatura_local = True
+
+    def __init__(self, directorio, url_base):
+        self.directorio = directorio
+        self.url_base = url_base.rstrip("/")
+        os.makedirs(directorio, exist_ok=True)
+
+    def subir(self, ruta):
+        _, ext = os.path.splitext(ruta.removesuffix(TOMADO))
+        nombre = uuid.uuid4().hex + ext
+        shutil.copyfile(ruta, os.path.join(self.directorio, nombre))
+        return f"{self.url_base}/{nombre}", nombre
+
+    def miniatura(self, ruta, public_id):
+        # El nombre se deriva del de la foto para poder borrarlas juntas
+        base, ext = os.path.splitext(public_id)
+        nombre = f"{base}-min{ext}"
+        shutil.copyfile(ruta, os.path.join(self.directorio, nombre))
+        return f"{self.url_base}/{nombre}"
+
+
+# -------------------------
+# COLA
+# -------------------------
+class ColaSubidas:
+    def __init__(self, backend, directorio, al_terminar, al_fallar,
+                 procesar=None, workers=2, max_pendientes=100, reintentos=4,
+                 espera=1.0, revisar_cada=30.0, vencido=600, reintentar_cada=3600,
+                 rondas=5):
+        self.backend = backend
+        self.procesar = procesar
+        self.directorio = directorio
+        self.al_terminar = al_terminar
+        self.al_fallar = al_fallar
+        self.workers = workers
+        self.reintentos = reintentos
+        self.espera = espera
+        self.revisar_cada = revisar_cada
+        self.vencido = vencido
+        self.reintentar_cada = reintentar_cada
+        self.rondas = rondas
+
+        self.max_pendientes = max_pendientes
+        self._cola = queue.Queue(maxsize=max_pendientes)
+        self._hilos = []
+        self._pid = None
+        self._lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+
+    def iniciar(self):
+        """Arranca los hilos en este proceso si aún no corren.
+
+        Se llama desde el proceso que atiende peticiones, no al importar: así
+        la CLI no toma archivos del spool y, con gunicorn --preload, cada
+        worker (proceso hijo) arranca sus propios hilos en vez de heredar
+        la lista del maestro. Al arrancar se retoma lo que haya en el spool.
+        """
+        with self._lock:
+            if self._pid == os.getpid() and all(h.is_alive() for h in self._hilos):
+                return
+            if self._pid != os.getpid():
+                # Tras un fork la cola heredada puede tener candados tomados
+                self._cola = queue.Queue(maxsize=self.max_pendientes)
+            self._pid = os.getpid()
+            self._hilos = [h for h in self._hilos if h.is_alive()]
+            for i in range(len(self._hilos), self.workers):
+                hilo = threading.Thread(target=self._trabajar, args=(i == 0,),
+                                        name=f"subidas-{i}", daemon=True)
+                hilo.start()
+                self._hilos.append(hilo)
+
+    def guardar(self, gasto_id, archivo):
+        """Escribe los bytes del archivo en el spool y los encola."""
+        _, ext = os.path.splitext(archivo.filename or "")
+        ext = ext.lower() if ext.lower() in EXTENSIONES else ""
+        ruta = os.path.join(self.directorio, f"{PREFIJO}{gasto_id}{ext}")
+        archivo.save(ruta + TEMPORAL)
+        os.replace(ruta + TEMPORAL, ruta)
+        self.encolar(ruta)
+        return ruta
+
+    def encolar(self, ruta):
+        self.iniciar()
+        try:
+            self._cola.put_nowait(ruta)
+        except queue.Full:
+            # Sigue en el spool; un hilo libre lo encontrará al revisar.
+            log.warning("Cola de subidas llena, %s queda en spool", ruta)
+
+    def _barrer(self):
+        """Libera tomas vencidas, reintenta fallidas y encola el spool."""
+        self._revisar()
+        for ruta in self._en_spool():
+            try:
+                self._cola.put_nowait(ruta)
+            except queue.Full:
+                break
+
+    def esperar(self):
+        """Bloquea hasta que la cola en memoria quede vacía."""
+        self._cola.join()
+
+    def _en_spool(self):
+        for nombre in sorted(os.listdir(self.directorio)):
+            if nombre.startswith(PREFIJO) and not nombre.endswith((TOMADO, FALLIDO, SUBIDA, TEMPORAL)):
+                yield os.path.join(self.directorio, nombre)
+
+    def _revisar(self):
+        """Libera tomas vencidas, reintenta fallidas y repite avisos pendientes."""
+        ahora = time.time()
+        for nombre in os.listdir(self.directorio):
+            if not nombre.startswith(PREFIJO):
+                continue
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                edad = ahora - os.path.getmtime(ruta)
+                if nombre.endswith(TOMADO) and edad > self.vencido:
+                    os.replace(ruta, ruta.removesuffix(TOMADO))
+                elif nombre.endswith(FALLIDO) and edad > self.reintentar_cada:
+                    self._reintentar(ruta)
+                elif nombre.endswith(SUBIDA):
+                    self._avisar(ruta)
+            except FileNotFoundError:
+                pass  # otro hilo o proceso se adelantó
+            except Exception:
+                log.exception("Error revisando %s", nombre)
+
+    def _reintentar(self, ruta):
+        original = ruta.removesuffix(FALLIDO)
+        nombre = os.path.basename(original)
+        ronda = _ronda(nombre) + 1
+        if ronda > self.rondas:
+            log.error("Se descarta %s tras %d rondas de reintentos", nombre, self.rondas)
+            os.remove(ruta)
+            return
+        _, ext = os.path.splitext(nombre)
+        nueva = os.path.join(self.directorio, f"{PREFIJO}{_gasto_id(nombre)}-r{ronda}{ext}")
+        os.replace(ruta, nueva)
+
+    def _avisar(self, ruta):
+        tomada = ruta + TOMADO
+        os.rename(ruta, tomada)
+        os.utime(tomada)
+        with open(tomada) as f:
+            resultado = json.load(f)
+        try:
+            self.al_terminar(_gasto_id(os.path.basename(ruta)), *resultado)
+        except Exception:
+            log.exception("Sigue fallando el aviso de %s", os.path.basename(ruta))
+            os.replace(tomada, ruta)
+            return
+        os.remove(tomada)
+
+    def _trabajar(self, barrer_al_iniciar=False):
+        if barrer_al_iniciar:
+            self._barrer()
+        while True:
+            try:
+                ruta = self._cola.get(timeout=self.revisar_cada)
+            except queue.Empty:
+                self._barrer()
+                continue
+            try:
+                self._procesar(ruta)
+            except Exception:
+                log.exception("Error inesperado subiendo %s", ruta)
+            finally:
+                self._cola.task_done()
+
+    def _procesar(self, ruta):
+        tomada = ruta + TOMADO
+        try:
+            os.rename(ruta, tomada)
+        except FileNotFoundError:
+            return  # otro hilo o proceso ya la tomó (o la repitió el barrido)
+        # La antigüedad de la toma se mide desde aquí, no desde que se escribió
+        os.utime(tomada)
+
+        nombre = os.path.basename(ruta)
+        gasto_id = _gasto_id(nombre)
+
+        principal, miniatura = tomada, None
+        if self.procesar:
+            try:
+                principal, miniatura = self.procesar(tomada, self.backend.miniatura_local)
+            except Exception as e:
+                log.warning("No se pudo procesar %s, se sube el original: %s", nombre, e)
+
+        try:
+            url, public_id = self._subir(nombre, self.backend.subir, principal)
+            miniatura_url = None
+            if miniatura or not self.backend.miniatura_local:
+                try:
+                    miniatura_url = self._subir(nombre, self.backend.miniatura, miniatura, public_id)
+                except Exception as e:
+                    log.warning("Sin miniatura para %s: %s", nombre, e)
+        except Exception as e:
+            fallida = ruta + FALLIDO
+            os.replace(tomada, fallida)
+            # La espera para la siguiente ronda cuenta desde el fallo
+            os.utime(fallida)
+            self.al_fallar(gasto_id, e)
+            return
+        finally:
+            for extra in {principal, miniatura} - {tomada, None}:
+                os.remove(extra)
+
+        resultado = [url, public_id, miniatura_url]
+        try:
+            self.al_terminar(gasto_id, *resultado)
+        except Exception:
+            # Ya está subida: se guarda el resultado para repetir solo el aviso
+            log.exception("Falló el aviso de %s, se reintentará", nombre)
+            with open(ruta + SUBIDA + TEMPORAL, "w") as f:
+                json.dump(resultado, f)
+            os.replace(ruta + SUBIDA + TEMPORAL, ruta + SUBIDA)
+        os.remove(tomada)
+
+    def _subir(self, nombre, fn, *args):
+        for intento in range(self.reintentos + 1):
+            try:
+                return fn(*args)
+            except Exception as e:
+                log.warning("Subida de %s falló (intento %d): %s", nombre, intento + 1, e)
+                if intento == self.reintentos:
+                    raise
+                time.sleep(self.espera * 2 ** intento)
@@ -0,0 +1,25 @@
+"""Base de datos y spool temporales antes de importar la app."""
+import os
+import sys
+import tempfile
+
+import pytest
+
+_tmp = tempfile.mkdtemp(prefix="construar-test-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_tmp, "test.db")
+os.environ["SUBIDAS_BACKEND"] = "local"
+os.environ["SUBIDAS_DIR"] = os.path.join(_tmp, "subidas")
+os.environ["CACHE_TTL"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def sesion():
+    import main
+
+    with main.app.app_context():
+        yield main.db.session
+        main.db.session.rollback()
+        for modelo in (main.Gasto, main.PartidaPresupuesto, main.ResumenObra, main.Obra):
+            main.db.session.query(modelo).delete()
+        main.db.session.commit()
@@ -0,0 +1,44 @@
+"""Validación de filas importadas y escape del CSV exportado."""
+import csv
+import io
+from datetime import date
+
+import pytest
+
+from intercambio import csv_por_bloques, validar_fila
+
+OBRAS_POR_ID = {1: "Casa"}
+OBRAS_POR_NOMBRE = {"Casa": 1}
+
+
+def _fila(**valores):
+    fila = {"obra_id": "1", "fecha": "2025-01-01", "concepto": "Cemento", "monto": "10"}
+    fila.update(valores)
+    return fila
+
+
+@pytest.mark.parametrize("fila", [
+    _fila(monto="nan"),
+    _fila(monto="inf"),
+    _fila(monto="1e400"),
+    _fila(obra_id="1e400"),
+    _fila(obra_id=[1]),
+])
+def test_rechaza_valores_no_finitos_o_mal_formados(fila):
+    with pytest.raises(ValueError):
+        validar_fila(fila, OBRAS_POR_ID, OBRAS_POR_NOMBRE)
+
+
+def test_acepta_fila_valida():
+    assert validar_fila(_fila(monto="$1,250.50"), OBRAS_POR_ID, OBRAS_POR_NOMBRE) == {
+        "obra_id": 1, "fecha": date(2025, 1, 1), "concepto": "Cemento", "monto": 1250.5,
+    }
+
+
+def test_csv_escapa_formulas_en_texto():
+    filas = [(1, date(2025, 1, 1), 1, "=HYPERLINK(\"x\")", "+SUMA(A1)", -5.0, None),
+             (2, date(2025, 1, 2), 1, "@obra", "-descuento", 3.5, "https://x/y.webp")]
+    texto = "".join(csv_por_bloques(filas)).lstrip("\ufeff")
+    renglones = list(csv.reader(io.StringIO(texto)))
+    assert renglones[1][3:6] == ["'=HYPERLINK(\"x\")", "'+SUMA(A1)", "-5.0"]
+    assert renglones[2][3:7] == ["'@obra", "'-descuento", "3.5", "https://x/y.webp"]
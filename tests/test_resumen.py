@@ -0,0 +1,49 @@
+"""El resumen por obra debe cuadrar con los datos tras ediciones y borrados."""
+from datetime import date
+
+from main import Gasto, Obra, PartidaPresupuesto, verificar_resumen
+
+
+def _datos(sesion):
+    obras = [Obra(nombre="Casa"), Obra(nombre="Bodega")]
+    sesion.add_all(obras)
+    sesion.flush()
+    gastos = [
+        Gasto(obra_id=obras[0].id, concepto="Cemento", monto=5.0, fecha=date(2025, 1, 1)),
+        Gasto(obra_id=obras[0].id, concepto="Varilla", monto=10.0, fecha=date(2025, 1, 2)),
+        Gasto(obra_id=obras[1].id, concepto="Flete", monto=7.0, fecha=date(2025, 1, 3)),
+    ]
+    partida = PartidaPresupuesto(obra_id=obras[0].id, partida="CIM", descripcion="Cimentación",
+                                 cantidad=2, precio_unitario=100)
+    sesion.add_all([*gastos, partida])
+    sesion.commit()
+    assert verificar_resumen() == []
+    return obras, gastos, partida
+
+
+def test_editar_tras_commit(sesion):
+    obras, gastos, partida = _datos(sesion)
+    # Tras el commit los atributos están expirados
+    gastos[0].obra_id = obras[1].id
+    gastos[1].monto = 20.0
+    gastos[2].fecha = date(2025, 2, 1)
+    partida.cantidad = 5
+    sesion.commit()
+    assert verificar_resumen() == []
+
+    partida.obra_id = obras[1].id
+    partida.precio_unitario = 3
+    sesion.commit()
+    assert verificar_resumen() == []
+
+
+def test_borrar_tras_commit(sesion):
+    obras, gastos, partida = _datos(sesion)
+    sesion.delete(gastos[1])
+    sesion.delete(partida)
+    sesion.commit()
+    assert verificar_resumen() == []
+
+    sesion.delete(gastos[2])
+    sesion.commit()
+    assert verificar_resumen() == []
@@ -0,0 +1,210 @@
+"""Cola de subidas: reintentos, rondas de .error, aviso repetido y tomas vencidas."""
+import io
+import os
+import threading
+import time
+from datetime import date
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+import main
+from main import Gasto, Obra
+from subidas import FALLIDO, SUBIDA, TOMADO, ColaSubidas, SubidaLocal
+
+
+def _jpeg():
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), (200, 100, 50)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def _archivo(nombre="ticket.jpg"):
+    return FileStorage(io.BytesIO(_jpeg()), filename=nombre)
+
+
+class SubidaQueFalla:
+    miniatura_local = True
+
+    def __init__(self):
+        self.llamadas = 0
+
+    def subir(self, ruta):
+        self.llamadas += 1
+        raise OSError("sin red")
+
+    def miniatura(self, ruta, public_id):
+        raise OSError("sin red")
+
+
+@pytest.fixture
+def gasto(sesion):
+    obra = Obra(nombre="Casa")
+    sesion.add(obra)
+    sesion.flush()
+    g = Gasto(obra_id=obra.id, concepto="Cemento", monto=10, fecha=date(2025, 1, 1), foto_estado="pendiente")
+    sesion.add(g)
+    sesion.commit()
+    return g.id
+
+
+def _estado(sesion, gasto_id):
+    sesion.expire_all()
+    return sesion.get(Gasto, gasto_id).foto_estado
+
+
+def _cola(tmp_path, backend, **opciones):
+    opciones.setdefault("al_terminar", main.foto_subida)
+    return ColaSubidas(
+        backend, str(tmp_path / "spool"), opciones.pop("al_terminar"), main.foto_fallida,
+        espera=0, revisar_cada=3600, **opciones,
+    )
+
+
+def test_sube_desde_la_vista(sesion, gasto):
+    obra_id = sesion.get(Gasto, gasto).obra_id
+    respuesta = main.app.test_client().post("/gastos", data={
+        "obra_id": obra_id, "concepto": "Varilla", "monto": "25", "fecha": "2025-01-02",
+        "ticket": (io.BytesIO(_jpeg()), "ticket.jpg"),
+    }, content_type="multipart/form-data")
+    assert respuesta.status_code == 302
+    main.cola_subidas.esperar()
+
+    nuevo = sesion.query(Gasto).filter_by(concepto="Varilla").one()
+    assert nuevo.foto_estado == "subida"
+    assert nuevo.foto_url.startswith("/tickets/")
+    assert nuevo.foto_miniatura_url.endswith("-min.webp")
+    assert os.listdir(main.cola_subidas.directorio) == []
+
+
+class SubidaTransformada(SubidaLocal):
+    """Como Cloudinary: la miniatura es una URL derivada, no un archivo."""
+
+    miniatura_local = False
+
+    def miniatura(self, ruta, public_id):
+        assert ruta is None
+        return f"{self.url_base}/{public_id}?w=280"
+
+
+def test_sin_miniatura_local_no_la_genera(sesion, gasto, tmp_path):
+    procesadas = []
+
+    def procesar(ruta, miniatura=True):
+        resultado = main.procesar_foto(ruta, miniatura)
+        procesadas.append(resultado)
+        return resultado
+
+    tickets = tmp_path / "tickets"
+    cola = _cola(tmp_path, SubidaTransformada(str(tickets), "/tickets"), procesar=procesar)
+    cola.guardar(gasto, _archivo())
+    cola.esperar()
+
+    assert procesadas[0][1] is None
+    g = sesion.get(Gasto, gasto)
+    sesion.refresh(g)
+    assert g.foto_estado == "subida"
+    assert g.foto_miniatura_url == f"{g.foto_url}?w=280"
+    assert len(os.listdir(tickets)) == 1
+
+
+def test_error_tras_reintentos_y_rondas(sesion, gasto, tmp_path):
+    backend = SubidaQueFalla()
+    cola = _cola(tmp_path, backend, reintentos=2, rondas=1, reintentar_cada=0)
+    cola.guardar(gasto, _archivo())
+    cola.esperar()
+
+    assert backend.llamadas == 3
+    assert _estado(sesion, gasto) == "error"
+    assert os.listdir(cola.directorio) == [f"gasto-{gasto}.jpg{FALLIDO}"]
+
+    # La revisión periódica la vuelve a encolar como ronda 1...
+    cola._revisar()
+    assert os.listdir(cola.directorio) == [f"gasto-{gasto}-r1.jpg"]
+    cola.encolar(os.path.join(cola.directorio, f"gasto-{gasto}-r1.jpg"))
+    cola.esperar()
+    assert os.listdir(cola.directorio) == [f"gasto-{gasto}-r1.jpg{FALLIDO}"]
+
+    # ...y al agotar las rondas la descarta
+    cola._revisar()
+    assert os.listdir(cola.directorio) == []
+    assert _estado(sesion, gasto) == "error"
+
+
+def test_error_se_recupera_en_la_siguiente_ronda(sesion, gasto, tmp_path):
+    backend = SubidaQueFalla()
+    cola = _cola(tmp_path, backend, reintentos=0, reintentar_cada=0)
+    cola.guardar(gasto, _archivo())
+    cola.esperar()
+    assert _estado(sesion, gasto) == "error"
+
+    cola.backend = SubidaLocal(str(tmp_path / "tickets"), "/tickets")
+    cola._barrer()
+    cola.esperar()
+    assert _estado(sesion, gasto) == "subida"
+    assert os.listdir(cola.directorio) == []
+
+
+def test_aviso_fallido_se_repite_sin_volver_a_subir(sesion, gasto, tmp_path):
+    avisos = []
+
+    def aviso_que_falla(*args):
+        avisos.append(args)
+        if len(avisos) == 1:
+            raise RuntimeError("database is locked")
+        main.foto_subida(*args)
+
+    tickets = tmp_path / "tickets"
+    cola = _cola(tmp_path, SubidaLocal(str(tickets), "/tickets"), al_terminar=aviso_que_falla)
+    cola.guardar(gasto, _archivo())
+    cola.esperar()
+
+    assert os.listdir(cola.directorio) == [f"gasto-{gasto}.jpg{SUBIDA}"]
+    assert _estado(sesion, gasto) == "pendiente"
+    subidos = sorted(os.listdir(tickets))
+
+    cola._revisar()
+    assert os.listdir(cola.directorio) == []
+    assert _estado(sesion, gasto) == "subida"
+    assert avisos[0] == avisos[1]
+    assert sorted(os.listdir(tickets)) == subidos
+
+
+def test_libera_tomas_vencidas(tmp_path):
+    cola = _cola(tmp_path, SubidaQueFalla(), vencido=600)
+    vieja = os.path.join(cola.directorio, "gasto-1.jpg" + TOMADO)
+    reciente = os.path.join(cola.directorio, "gasto-2.jpg" + TOMADO)
+    for ruta in (vieja, reciente):
+        open(ruta, "wb").close()
+    hace_una_hora = time.time() - 3600
+    os.utime(vieja, (hace_una_hora, hace_una_hora))
+
+    cola._revisar()
+    assert sorted(os.listdir(cola.directorio)) == ["gasto-1.jpg", "gasto-2.jpg" + TOMADO]
+
+
+@pytest.mark.parametrize("nombre", ["x.tmp", "x.subida", "x.error", "x.subiendo", "sin_extension"])
+def test_extension_del_cliente_no_choca_con_los_estados(tmp_path, nombre):
+    cola = _cola(tmp_path, SubidaQueFalla())
+    # Sin hilos: el archivo se queda en el spool
+    cola._pid = os.getpid()
+    assert cola.guardar(7, _archivo(nombre)).endswith("gasto-7")
+    assert [os.path.basename(r) for r in cola._en_spool()] == ["gasto-7"]
+
+
+def test_iniciar_arranca_hilos_en_un_proceso_nuevo(tmp_path):
+    cola = _cola(tmp_path, SubidaQueFalla(), workers=2)
+    cola.iniciar()
+    hilos = list(cola._hilos)
+    cola.iniciar()
+    assert cola._hilos == hilos
+
+    # Tras un fork (gunicorn --preload) el hijo hereda la lista, pero sus
+    # hilos no existen en el proceso nuevo
+    cola._pid = -1
+    cola._hilos = [threading.Thread(target=lambda: None) for _ in range(2)]
+    cola.iniciar()
+    assert cola._pid == os.getpid()
+    assert len(cola._hilos) == 2
+    assert all(h.is_alive() for h in cola._hilos)
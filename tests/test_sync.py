@@ -0,0 +1,87 @@
+"""/api/sync: claves repetidas, rechazados y paginación por token."""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import main
+from main import Gasto, Obra
+
+
+@pytest.fixture
+def obra(sesion):
+    o = Obra(nombre="Casa")
+    sesion.add(o)
+    sesion.commit()
+    return o.id
+
+
+@pytest.fixture
+def cliente():
+    return main.app.test_client()
+
+
+def _gasto(obra_id, clave, monto="10"):
+    return {"clave": clave, "obra_id": obra_id, "fecha": "2025-01-01", "concepto": "Cemento", "monto": monto}
+
+
+def test_clave_repetida_no_duplica(sesion, obra, cliente):
+    primero = cliente.post("/api/sync", json={"gastos": [_gasto(obra, "abc")]}).get_json()
+    assert primero["aceptados"] == [{"clave": "abc", "id": primero["aceptados"][0]["id"], "duplicado": False}]
+
+    # El celular no recibió la respuesta y reenvía el mismo gasto
+    segundo = cliente.post("/api/sync", json={"gastos": [_gasto(obra, "abc"), _gasto(obra, "abc")]}).get_json()
+    assert segundo["aceptados"] == [{"clave": "abc", "id": primero["aceptados"][0]["id"], "duplicado": True}]
+    assert sesion.query(Gasto).filter_by(clave="abc").count() == 1
+    assert main.verificar_resumen() == []
+
+
+def test_rechazados(sesion, obra, cliente):
+    respuesta = cliente.post("/api/sync", json={"gastos": [
+        _gasto(obra, "ok"),
+        _gasto(obra, "nan", monto="nan"),
+        _gasto(999, "sin-obra"),
+        {"obra_id": obra, "fecha": "2025-01-01", "concepto": "x", "monto": "1"},
+        "no es objeto",
+    ]})
+    assert respuesta.status_code == 200
+    r = respuesta.get_json()
+    assert [a["clave"] for a in r["aceptados"]] == ["ok"]
+    assert [x["clave"] for x in r["rechazados"]] == ["nan", "sin-obra", None, None]
+    assert sesion.query(Gasto).count() == 1
+
+
+@pytest.mark.parametrize("cuerpo", [[1, 2], {"gastos": "x"}, {"obra_id": "abc"}])
+def test_lote_mal_formado(cliente, cuerpo):
+    assert cliente.post("/api/sync", json=cuerpo).status_code == 400
+
+
+def test_token_pagina_los_cambios(sesion, obra, cliente, monkeypatch):
+    monkeypatch.setitem(main.app.config, "SYNC_LIMITE", 2)
+    hace_rato = datetime.utcnow() - timedelta(minutes=10)
+    for i in range(3):
+        sesion.add(Gasto(obra_id=obra, concepto=f"G{i}", monto=1, fecha=date(2025, 1, 1),
+                         actualizado=hace_rato + timedelta(seconds=i)))
+    sesion.commit()
+
+    # Sin token se empieza desde ahora: no se descarga el historial
+    r = cliente.post("/api/sync", json={"obra_id": obra}).get_json()
+    assert r["cambios"] == [] and r["token"]
+
+    token = f"{(hace_rato - timedelta(seconds=1)).isoformat()}_0"
+    r = cliente.post("/api/sync", json={"obra_id": obra, "token": token}).get_json()
+    assert [g["concepto"] for g in r["cambios"]] == ["G0", "G1"]
+    assert r["mas"] is True
+
+    r = cliente.post("/api/sync", json={"obra_id": obra, "token": r["token"]}).get_json()
+    assert [g["concepto"] for g in r["cambios"]] == ["G2"]
+    assert r["mas"] is False
+
+    r = cliente.post("/api/sync", json={"obra_id": obra, "token": r["token"]}).get_json()
+    assert r["cambios"] == [] and r["mas"] is False
+
+
+def test_la_pagina_lleva_su_token(sesion, obra, cliente):
+    html = cliente.get(f"/gastos?obra_id={obra}").get_data(as_text=True)
+    assert 'id="lista-gastos"' in html
+    assert f'data-obra="{obra}"' in html
+    assert 'data-token="' in html